@@ -1,19 +1,36 @@
-from fastapi import FastAPI, Request, UploadFile, File, Form
+from fastapi import FastAPI, Request, Response, UploadFile, File, Form, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from langchain.tools import tool
 from langchain_openai import ChatOpenAI
-from tools import get_weather, brave_search, get_current_date, github_code_search, fetch_github_repo_code_summary, vision_analyze
-from semantic_search import router as semantic_router
+from tools import get_weather, brave_search, get_current_date, github_code_search, fetch_github_repo_code_summary, vision_analyze, search_project_code
+from semantic_search import router as semantic_router, retrieve_context
+from jobs import job_queue
 from langgraph.graph import StateGraph, END
 import json
 from langchain_core.messages import ToolMessage, HumanMessage, AIMessage, BaseMessage, SystemMessage
-from langgraph.checkpoint.memory import MemorySaver
-from typing import TypedDict
+from langchain_core.callbacks.manager import adispatch_custom_event
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph.message import add_messages
+from checkpoints import create_checkpointer, close_checkpointer
+from context_budget import fit_to_budget, count_text_tokens
+from http_client import close_clients, Deadline, current_deadline
+from openai_clients import get_http_client, get_async_http_client, close_openai_clients, OPENAI_BASE_URL, CHAT_MODEL, VISION_MODEL
+from tool_cache import cache_stats
+from reply_cache import reply_cache, digest, history_fingerprint, REPLY_CACHE_DISABLED, UNCACHEABLE_TOOLS
+from chroma_registry import registry, collection_name
+from metrics import (TraceMiddleware, LLM_SECONDS, LLM_TOKENS, TOOL_SECONDS, record_stage, render_metrics,
+                     monitor_loop_lag, profiler, worker_scope, PROFILER_ENABLED, PROFILER_TOKEN)
+from typing import TypedDict, Annotated
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+import contextvars
 import os
+import time
 import base64
 from tools import VisionInput
 from dotenv import load_dotenv
-import openai
 import uuid
 
 # Load environment variables
@@ -21,8 +38,6 @@ load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
-
 app = FastAPI()
 
 app.add_middleware(
@@ -33,15 +48,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(TraceMiddleware)
+
 app.include_router(semantic_router, prefix="/semantic")
 
 # ---------- LangChain Tools ----------
 
-langchain_llm = ChatOpenAI(api_key=OPENAI_API_KEY, model="gpt-4o")
+langchain_llm = ChatOpenAI(
+    api_key=OPENAI_API_KEY,
+    model=CHAT_MODEL,
+    stream_usage=True,      # token counts for /metrics on streamed turns too
+    base_url=OPENAI_BASE_URL,
+    http_client=get_http_client(),
+    http_async_client=get_async_http_client(),
+)
+
+tools = [get_weather, brave_search, get_current_date, fetch_github_repo_code_summary, github_code_search, search_project_code]
+
+# Tools are blocking (requests/HTTP), so they run on a bounded pool instead of the event loop
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "8"))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "30"))
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
 
-memory = MemorySaver()
+# "file" always sends the whole active file, "retrieval" replaces it with the project's best-matching
+# chunks, "auto" does so only for files over RETRIEVAL_FILE_TOKENS (and only if the project is indexed)
+CHAT_CONTEXT_MODE = os.getenv("CHAT_CONTEXT_MODE", "auto")
+RETRIEVAL_FILE_TOKENS = int(os.getenv("RETRIEVAL_FILE_TOKENS", "4000"))
+RETRIEVAL_CONTEXT_TOKENS = int(os.getenv("RETRIEVAL_CONTEXT_TOKENS", "3000"))
 
-tools = [get_weather, brave_search, get_current_date, fetch_github_repo_code_summary, github_code_search]
+# "native" sends images to the chat model as image_url parts of the user message; "prepass" asks
+# vision_analyze for a description first (concurrently with retrieval) and sends that as text
+VISION_MODE = os.getenv("VISION_MODE", "native")
 
 # ---------- LangGraph Flow ----------
 
@@ -67,26 +104,91 @@ def ensure_base_message(msg):
 
 # Tool node
 class BasicToolNode:
-    def __init__(self, tools: list) -> None:
+    """
+    Runs every tool call from the last AI message concurrently.
+    Each call gets its own timeout and failures are reported back to the model as a
+    ToolMessage instead of failing the whole turn.
+    Arguments a tool marks as InjectedToolArg (hidden from the model) are filled from
+    the run's `configurable`, e.g. the machine_id/project_name of the chat request.
+    """
+    def __init__(self, tools: list, max_concurrency: int = TOOL_MAX_WORKERS,
+                 timeout: float = TOOL_TIMEOUT_SECONDS, timeouts: dict = None) -> None:
         self.tools_by_name = {tool.name: tool for tool in tools}
-
-    def __call__(self, inputs: dict):
+        self.injected_args = {
+            tool.name: set(tool.get_input_schema().model_fields) - set(tool.tool_call_schema.model_fields)
+            for tool in tools
+        }
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+
+    async def _run_tool(self, tool_call: dict, semaphore: asyncio.Semaphore, config: RunnableConfig) -> ToolMessage:
+        name = tool_call["name"]
+        timeout = self.timeouts.get(name, self.timeout)
+        # Progress events for /chat/stream; no-ops when nobody is listening
+        await adispatch_custom_event(
+            "tool_start",
+            {"id": tool_call["id"], "name": name, "args": tool_call["args"]},
+            config=config,
+        )
+        status = "ok"
+        start = time.perf_counter()
+        async with semaphore:
+            try:
+                tool = self.tools_by_name[name]
+                configurable = config.get("configurable", {})
+                args = {**tool_call["args"], **{
+                    arg: configurable[arg] for arg in self.injected_args[name] if arg in configurable
+                }}
+                loop = asyncio.get_running_loop()
+                # Copy the context so the request's trace ID follows the tool onto the worker thread,
+                # along with a deadline its upstream requests honour
+                deadline = Deadline(timeout)
+                context = contextvars.copy_context()
+                context.run(current_deadline.set, deadline)
+                try:
+                    tool_result = await asyncio.wait_for(
+                        loop.run_in_executor(tool_executor, context.run, tool.invoke, args),
+                        timeout=timeout,
+                    )
+                finally:
+                    # wait_for only stops waiting; this stops the thread at its next request or retry
+                    deadline.cancel()
+            except asyncio.TimeoutError:
+                status = "timeout"
+                tool_result = {"error": f"Tool '{name}' timed out after {timeout}s."}
+            except KeyError:
+                status = "error"
+                tool_result = {"error": f"Unknown tool '{name}'."}
+            except Exception as e:
+                print(f"error in tool {name}:", e)
+                status = "error"
+                tool_result = {"error": f"Tool '{name}' failed: {e}"}
+        elapsed = time.perf_counter() - start
+        TOOL_SECONDS.observe(elapsed, tool=name, status=status)
+        record_stage("tool", elapsed, tool=name)
+        await adispatch_custom_event(
+            "tool_end",
+            {"id": tool_call["id"], "name": name, "status": status},
+            config=config,
+        )
+        return ToolMessage(
+            content=json.dumps(tool_result),
+            name=name,
+            tool_call_id=tool_call["id"],
+        )
+
+    async def __call__(self, inputs: dict, config: RunnableConfig):
         messages = [ensure_base_message(m) for m in inputs.get("messages", [])]
         message = messages[-1]
-        outputs = []
-        for tool_call in getattr(message, "tool_calls", []):
-            tool_result = self.tools_by_name[tool_call["name"]].invoke(
-                tool_call["args"]
-            )
-            outputs.append(
-                ToolMessage(
-                    content=json.dumps(tool_result),
-                    name=tool_call["name"],
-                    tool_call_id=tool_call["id"],
-                )
-            )
-        # Append tool outputs to the message history
-        return {"messages": messages + outputs}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # gather keeps results in tool_calls order, so tool_call_ids line up with the AI message
+        outputs = await asyncio.gather(*(
+            self._run_tool(tool_call, semaphore, config)
+            for tool_call in getattr(message, "tool_calls", [])
+        ))
+        # Appended to the thread's history by the add_messages reducer
+        return {"messages": list(outputs)}
     
 tool_node = BasicToolNode(tools)
 
@@ -162,18 +264,30 @@ SYSTEM_PROMPT = (
 
 # LangGraph state
 class ChatState(TypedDict):
-    messages: list
+    messages: Annotated[list, add_messages]
 
-def chatbot_node(state: ChatState) -> ChatState:
+def record_llm_call(seconds: float, status: str, response: AIMessage = None) -> None:
+    LLM_SECONDS.observe(seconds, model=CHAT_MODEL, status=status)
+    record_stage("llm", seconds)
+    usage = getattr(response, "usage_metadata", None) or {}
+    LLM_TOKENS.inc(usage.get("input_tokens", 0), model=CHAT_MODEL, kind="prompt")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0), model=CHAT_MODEL, kind="completion")
+
+async def chatbot_node(state: ChatState) -> ChatState:
+    start = time.perf_counter()
     try:
         messages = [ensure_base_message(m) for m in state["messages"]]
-        response = llm_with_tools.invoke(messages)
-        print("hi")
-        return {"messages": messages + [response]}
+        # Only the prompt is trimmed; the thread keeps its full history
+        prompt = fit_to_budget(messages)
+        start = time.perf_counter()
+        response = await llm_with_tools.ainvoke(prompt)
+        record_llm_call(time.perf_counter() - start, "ok", response)
+        return {"messages": [response]}
     except Exception as e:
+        record_llm_call(time.perf_counter() - start, "error")
         print("error in chatbot_node:", e)
         # Append an AIMessage with the error
-        return {"messages": state["messages"] + [AIMessage(content=f"Error: {str(e)}")]}
+        return {"messages": [AIMessage(content=f"Error: {str(e)}")]}
         
     
 def chatbot_to_tools_or_end(state: ChatState) -> str:
@@ -192,30 +306,148 @@ builder.set_entry_point("chatbot")
 builder.add_conditional_edges("chatbot", chatbot_to_tools_or_end)
 builder.add_edge("tools", "chatbot")
 builder.add_edge("chatbot", END)
-chat_graph = builder.compile(checkpointer=memory)
+
+# Compiled on startup because the checkpoint store may need an async connection
+chat_graph = None
+checkpointer = None
+
+loop_monitor = None
+
+@app.on_event("startup")
+async def init_chat_graph():
+    global chat_graph, checkpointer
+    checkpointer = await create_checkpointer()
+    chat_graph = builder.compile(checkpointer=checkpointer)
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    global loop_monitor
+    loop_monitor = asyncio.create_task(monitor_loop_lag())
+
+@app.on_event("shutdown")
+async def close_chat_graph():
+    if loop_monitor is not None:
+        loop_monitor.cancel()
+    profiler.stop()
+    job_queue.shutdown()
+    await close_checkpointer(checkpointer)
+    await close_clients()
+    await close_openai_clients()
 
 # ---------- Endpoints ---------
 
-@app.post("/chat")
-async def chat(request: Request):
-    data = await request.json()
+DISCONNECT_POLL_INTERVAL = 0.5
+
+class ClientDisconnected(Exception):
+    pass
+
+async def run_until_disconnected(request: Request, coro):
+    """Run coro as a task and cancel it if the client goes away before it finishes."""
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def chat_thread(data: dict):
+    """
+    Resolve the conversation for a /chat request.
+    Returns (config, thread_id, history); a fresh thread ID is issued when the client sends none.
+    """
+    thread_id = str(data.get("thread_id") or uuid.uuid4())
+    # machine_id/project_name are read by tools through BasicToolNode, not stored in the checkpoint
+    config = {"configurable": {
+        "thread_id": thread_id,
+        "machine_id": data.get("machineId"),
+        "project_name": data.get("projectName"),
+    }}
+    snapshot = await chat_graph.aget_state(config)
+    return config, thread_id, snapshot.values.get("messages") or []
+
+async def retrieve_file_context(data: dict, user_message: str, selected_text: str, file_content: str):
+    """
+    Project chunks relevant to this turn, formatted to stand in for the whole-file context,
+    or None when the whole file should be sent (small file, mode "file", project not indexed).
+    """
+    mode = data.get("context_mode") or CHAT_CONTEXT_MODE
+    machine_id, project_name = data.get("machineId"), data.get("projectName")
+    if mode == "file" or not machine_id or not project_name:
+        return None
+    if mode == "auto" and count_text_tokens(file_content) <= RETRIEVAL_FILE_TOKENS:
+        return None
+
+    query = "\n".join(part for part in (user_message, selected_text) if part) or file_content[:2000]
+    try:
+        matches = await run_in_threadpool(
+            retrieve_context, machine_id, project_name, query, RETRIEVAL_CONTEXT_TOKENS
+        )
+    except Exception as e:
+        print("Retrieval failed, sending whole file:", e)
+        return None
+    if not matches:
+        return None
+
+    blocks = [
+        f"{m['file_path']} (lines {m['line_start']}-{m['line_end']}):\n```\n{m['snippet']}\n```"
+        for m in matches
+    ]
+    file_path = data.get("file_path")
+    header = "Relevant Project Code" + (f" (active file: {file_path})" if file_path else "")
+    return header + ":\n" + "\n\n".join(blocks)
+
+async def build_chat_messages(request: Request, data: dict, new_thread: bool = True, prepare: bool = True) -> list:
+    """
+    Turn a /chat request body into the new messages for this turn of the conversation.
+    prepare=False skips retrieval and the vision pre-pass, for turns answered from the reply
+    cache: those are recorded with the prompt and selection but not the file context.
+    """
     user_message   = data.get("prompt", "") or ""
     image_base64   = data.get("image_base64")
     file_content   = data.get("file_context")
     selected_text  = data.get("selection_text")   
 
-    vision_input = VisionInput(
-        image_base64=image_base64,
-        prompt=user_message if user_message else "Describe this image."
-    )
-
-    messages = [SystemMessage(content=SYSTEM_PROMPT)]
-
-    # 1) Base user prompt (or image description request)
-    if image_base64:
-        vision_result = vision_analyze(vision_input)
-        messages.append(HumanMessage(content=user_message or "Describe this image."))
-        messages.append(HumanMessage(content=f"Image Analysis:\n{vision_result}"))
+    image_prompt = user_message or "Describe this image."
+    if image_base64 and not image_base64.startswith("data:image"):
+        raise ValueError("Invalid image base64 data.")
+
+    async def analyze_image():
+        if image_base64 and VISION_MODE != "native":
+            return await run_in_threadpool(vision_analyze, VisionInput(image_base64=image_base64, prompt=image_prompt))
+        return None
+
+    async def retrieve():
+        if file_content:
+            return await retrieve_file_context(data, user_message, selected_text, file_content)
+        return None
+
+    # The vision pre-pass (if any) and retrieval are independent; run them side by side
+    async def gather_contexts():
+        return await asyncio.gather(analyze_image(), retrieve())
+    if prepare:
+        vision_result, retrieved = await run_until_disconnected(request, gather_contexts())
+    else:
+        vision_result = retrieved = file_content = None
+
+    # The system prompt is already in the history of an existing thread
+    messages = [SystemMessage(content=SYSTEM_PROMPT)] if new_thread else []
+
+    # 1) Base user prompt, with the image as a native part when the model sees it directly
+    if image_base64 and VISION_MODE == "native":
+        messages.append(HumanMessage(content=[
+            {"type": "text", "text": image_prompt},
+            {"type": "image_url", "image_url": {"url": image_base64}},
+        ]))
+    elif image_base64:
+        messages.append(HumanMessage(content=image_prompt))
+        if vision_result is not None:
+            messages.append(HumanMessage(content=f"Image Analysis:\n{vision_result}"))
     else:
         messages.append(HumanMessage(content=user_message))
 
@@ -225,22 +457,187 @@ async def chat(request: Request):
             content="Selected Code Context:\n```\n" + selected_text + "\n```"
         ))
 
-    if file_content:
+    if retrieved:
+        messages.append(HumanMessage(content=retrieved))
+    elif file_content:
         messages.append(HumanMessage(
             content="File Context:\n```\n" + file_content + "\n```"
         ))
 
     # (Optional) tiny nudge so the model prefers the selection if both exist
-    if selected_text and file_content:
+    if selected_text and (file_content or retrieved):
         messages.append(HumanMessage(
             content="If both contexts conflict, prioritize the Selected Code Context."
         ))
 
+    return messages
+
+def reply_from_state(state: dict) -> str:
+    last_message = state["messages"][-1]
+    return getattr(last_message, "content", str(last_message))
+
+# ---------- Reply cache ----------
+SYSTEM_PROMPT_VERSION = digest(SYSTEM_PROMPT)[:16]
+
+def reply_context(data: dict, history: list):
+    """Reply-cache context for a /chat request, or None when this request bypasses the cache."""
+    if REPLY_CACHE_DISABLED or data.get("no_cache"):
+        return None
+    machine_id, project_name = data.get("machineId"), data.get("projectName")
+    project = None
+    if machine_id and project_name:
+        # Retrieval results (and so the reply) change whenever the project is re-indexed
+        project = [machine_id, project_name, registry.generation(collection_name(machine_id, project_name))]
+    return reply_cache.context_key(
+        selection=digest(data.get("selection_text") or ""),
+        file=digest(data.get("file_context") or ""),
+        image=digest(data.get("image_base64") or ""),
+        context_mode=data.get("context_mode") or CHAT_CONTEXT_MODE,
+        model=langchain_llm.model_name,
+        system_prompt=SYSTEM_PROMPT_VERSION,
+        vision_mode=VISION_MODE,
+        vision_model=VISION_MODEL,
+        history=history_fingerprint(history),
+        project=project,
+    )
+
+def turn_tools(messages: list) -> set:
+    """Names of the tools called since the last human message."""
+    names = set()
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        names.update(c["name"] for c in getattr(message, "tool_calls", None) or [])
+    return names
+
+async def cached_reply(context, data: dict):
+    if context is None:
+        return None
+    return await run_in_threadpool(reply_cache.get, context, data.get("prompt", "") or "")
+
+async def record_cached_turn(config: dict, messages: list, reply: str) -> None:
+    """Append a turn answered from the cache to the thread, as if the model had produced it."""
+    await chat_graph.aupdate_state(config, {"messages": messages + [AIMessage(content=reply)]}, as_node="chatbot")
+
+async def remember_reply(context, data: dict, state: dict) -> None:
+    if context is None:
+        return
+    reply = reply_from_state(state)
+    if not isinstance(reply, str) or not reply or reply.startswith("Error"):
+        return
+    if turn_tools(state["messages"]) & UNCACHEABLE_TOOLS:
+        return
+    await run_in_threadpool(reply_cache.set, context, data.get("prompt", "") or "", reply)
+
+@app.post("/chat")
+async def chat(request: Request):
+    data = await request.json()
+
     try:
-        result = chat_graph.invoke({"messages": messages}, config={"configurable": {"thread_id": "1"}})
-        last_message = result["messages"][-1]
-        reply = getattr(last_message, "content", str(last_message))
-        return {"reply": reply}
+        config, thread_id, history = await chat_thread(data)
+        context = reply_context(data, history)
+        # Checked before build_chat_messages, so a hit skips retrieval and the vision pre-pass
+        reply = await cached_reply(context, data)
+        if reply is not None:
+            messages = await build_chat_messages(request, data, not history, prepare=False)
+            await record_cached_turn(config, messages, reply)
+            return {"reply": reply, "thread_id": thread_id, "cached": True}
+        messages = await build_chat_messages(request, data, not history)
+
+        result = await run_until_disconnected(
+            request,
+            chat_graph.ainvoke({"messages": messages}, config=config),
+        )
+        await remember_reply(context, data, result)
+        return {"reply": reply_from_state(result), "thread_id": thread_id}
+    except ClientDisconnected:
+        print("Client disconnected, cancelled /chat")
+        return Response(status_code=499)
     except Exception as e:
         print("LangGraph Error:", e)
-        return {"reply": f"Error processing request: {e}"}
\ No newline at end of file
+        return {"reply": f"Error processing request: {e}"}
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """
+    Server-sent events version of /chat.
+    Emits `token` events as the model streams, `tool_start`/`tool_end` around each tool call,
+    and a final `reply` event carrying the same payload /chat returns.
+    """
+    data = await request.json()
+
+    async def event_stream():
+        # Starlette cancels this generator (and the graph run inside it) when the client disconnects
+        try:
+            config, thread_id, history = await chat_thread(data)
+            context = reply_context(data, history)
+            reply = await cached_reply(context, data)
+            if reply is not None:
+                messages = await build_chat_messages(request, data, not history, prepare=False)
+                await record_cached_turn(config, messages, reply)
+                yield sse_event("token", {"content": reply})
+                yield sse_event("reply", {"reply": reply, "thread_id": thread_id, "cached": True})
+                return
+            messages = await build_chat_messages(request, data, not history)
+
+            async for event in chat_graph.astream_events({"messages": messages}, config=config, version="v2"):
+                kind = event["event"]
+                if kind == "on_chat_model_stream":
+                    content = event["data"]["chunk"].content
+                    if content:
+                        yield sse_event("token", {"content": content})
+                elif kind == "on_custom_event" and event["name"] in ("tool_start", "tool_end"):
+                    yield sse_event(event["name"], event["data"])
+
+            state = await chat_graph.aget_state(config)
+            await remember_reply(context, data, state.values)
+            yield sse_event("reply", {"reply": reply_from_state(state.values), "thread_id": thread_id})
+        except ClientDisconnected:
+            print("Client disconnected, cancelled /chat/stream")
+        except Exception as e:
+            print("LangGraph Error:", e)
+            yield sse_event("reply", {"reply": f"Error processing request: {e}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/tools/cache-stats")
+async def tool_cache_stats():
+    return {**cache_stats(), "replies": reply_cache.stats()}
+
+# ---------- Observability ----------
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus text format: latency histograms per stage (HTTP, LLM, tools, embeddings, Chroma, chunking).
+    With several workers each keeps its own; the response says which one answered.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4",
+                             headers={"X-Worker-Pid": str(worker_scope()["pid"])})
+
+def require_profiler(request: Request) -> None:
+    """The profiler endpoints exist only with ENABLE_PROFILER=1, and need PROFILER_TOKEN when one is set."""
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if PROFILER_TOKEN and request.headers.get("x-profiler-token") != PROFILER_TOKEN:
+        raise HTTPException(status_code=403, detail="Missing or wrong X-Profiler-Token.")
+
+@app.post("/debug/profiler/start", dependencies=[Depends(require_profiler)])
+async def start_profiler(interval_ms: float = 10):
+    profiler.start(interval_ms / 1000)
+    return {"status": "running", "interval_s": profiler.interval, "worker": worker_scope()}
+
+@app.post("/debug/profiler/stop", dependencies=[Depends(require_profiler)])
+async def stop_profiler():
+    """Stops sampling and returns folded stacks (feed to flamegraph.pl or speedscope)."""
+    return await run_in_threadpool(profiler.stop)
+
+@app.get("/debug/profiler", dependencies=[Depends(require_profiler)])
+async def profiler_report():
+    return profiler.report()
@@ -0,0 +1,228 @@
+"""
+Local stand-ins for every upstream the backend talks to, so benchmarks are offline and repeatable:
+  /v1/...      OpenAI chat completions (plain, streaming, tool calls) and embeddings
+  /github/...  GitHub code search and repo trees, replayed from fixtures (ETag aware)
+  /raw/...     raw.githubusercontent.com file bodies (Range aware)
+  /brave/...   Brave web search, replayed from a fixture
+Latency, jitter, 429 injection and the tool-call rate are configurable.
+"""
+import json
+import time
+import base64
+import random
+import asyncio
+import hashlib
+import threading
+from pathlib import Path
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FIXTURES = Path(__file__).parent / "fixtures"
+EMBEDDING_DIM = 1536
+
+def _fixture(name: str) -> dict:
+    return json.loads((FIXTURES / name).read_text(encoding="utf-8"))
+
+def fake_embedding(text: str) -> np.ndarray:
+    """Hashed bag of words, L2-normalized: texts sharing words land close together, like real embeddings."""
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for word in text.lower().split():
+        h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % EMBEDDING_DIM] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+class UpstreamConfig:
+    def __init__(self, latency_ms: float = 50, jitter_ms: float = 20, rate_limit_rate: float = 0.0,
+                 tool_call_rate: float = 0.0, reply_words: int = 60, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_rate = rate_limit_rate
+        self.tool_call_rate = tool_call_rate
+        self.reply_words = reply_words
+        self.random = random.Random(seed)
+        self.counts = {"chat": 0, "embeddings": 0, "embedded_inputs": 0, "rate_limited": 0,
+                       "github": 0, "raw": 0, "brave": 0}
+
+    async def delay(self, scale: float = 1.0) -> None:
+        ms = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) * scale
+        await asyncio.sleep(ms / 1000)
+
+    def throttled(self):
+        if self.rate_limit_rate and self.random.random() < self.rate_limit_rate:
+            self.counts["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached (injected)", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after-ms": "200"},
+            )
+        return None
+
+def create_app(config: UpstreamConfig) -> FastAPI:
+    app = FastAPI()
+    github_search = _fixture("github_search.json")
+    github_tree = _fixture("github_tree.json")
+    brave_results = _fixture("brave_search.json")
+
+    # ---------- OpenAI ----------
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await config.delay(0.2 + len(inputs) / 500)
+        throttled = config.throttled()
+        if throttled:
+            return throttled
+        config.counts["embeddings"] += 1
+        config.counts["embedded_inputs"] += len(inputs)
+        as_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text if isinstance(text, str) else " ".join(map(str, text)))
+            embedding = base64.b64encode(vector.tobytes()).decode("ascii") if as_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(str(t).split()) for t in inputs)
+        return {"object": "list", "data": data, "model": body.get("model"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await config.delay()
+        throttled = config.throttled()
+        if throttled:
+            return throttled
+        config.counts["chat"] += 1
+
+        messages = body.get("messages", [])
+        tool_names = {t["function"]["name"] for t in body.get("tools", [])}
+        last = messages[-1] if messages else {}
+        tool_calls = None
+        if last.get("role") != "tool" and tool_names and config.random.random() < config.tool_call_rate:
+            # Two calls in one turn, so BasicToolNode's fan-out is exercised
+            wanted = [("github_code_search", {"query": "fastapi streaming response"}),
+                      ("get_current_date", {})]
+            tool_calls = [
+                {"id": f"call_{i}_{config.random.getrandbits(32):x}", "type": "function",
+                 "function": {"name": name, "arguments": json.dumps(args)}}
+                for i, (name, args) in enumerate(wanted) if name in tool_names
+            ] or None
+
+        prompt = last.get("content") if isinstance(last.get("content"), str) else "your request"
+        words = ("This is a benchmark reply about " + prompt[:80]).split()
+        words += ["lorem"] * max(0, config.reply_words - len(words))
+        content = None if tool_calls else " ".join(words)
+        prompt_tokens = sum(len(json.dumps(m.get("content") or "")) // 4 for m in messages)
+        completion_tokens = 0 if tool_calls else len(words)
+        finish = "tool_calls" if tool_calls else "stop"
+        created = int(time.time())
+
+        if body.get("stream"):
+            async def chunks():
+                def frame(delta, finish_reason=None):
+                    payload = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created,
+                               "model": body.get("model"),
+                               "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+                    return f"data: {json.dumps(payload)}\n\n"
+                yield frame({"role": "assistant", "content": ""})
+                if tool_calls:
+                    yield frame({"tool_calls": [dict(c, index=i) for i, c in enumerate(tool_calls)]})
+                else:
+                    for i in range(0, len(words), 5):
+                        await asyncio.sleep(0.002)
+                        yield frame({"content": " ".join(words[i:i + 5]) + " "})
+                yield frame({}, finish)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": created,
+            "model": body.get("model"),
+            "choices": [{"index": 0, "finish_reason": finish,
+                         "message": {"role": "assistant", "content": content, "tool_calls": tool_calls}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    # ---------- GitHub / Brave replays ----------
+    def replay(request: Request, payload: dict, counter: str) -> Response:
+        config.counts[counter] += 1
+        body = json.dumps(payload).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(body, media_type="application/json", headers={"ETag": etag})
+
+    @app.get("/github/search/code")
+    async def github_code_search(request: Request):
+        await config.delay(0.5)
+        return replay(request, github_search, "github")
+
+    @app.get("/github/repos/{owner}/{repo}/git/trees/{ref}")
+    async def github_tree_endpoint(request: Request, owner: str, repo: str, ref: str):
+        await config.delay(0.5)
+        return replay(request, github_tree, "github")
+
+    @app.get("/raw/{path:path}")
+    async def raw_file(request: Request, path: str):
+        await config.delay(0.2)
+        config.counts["raw"] += 1
+        content = (f"# {path}\n" + "".join(
+            f"def handler_{i}(request):\n    return process(request, step={i})\n\n" for i in range(200)
+        )).encode("utf-8")
+        byte_range = request.headers.get("range", "")
+        if byte_range.startswith("bytes=0-"):
+            end = int(byte_range.split("-", 1)[1]) + 1
+            return Response(content[:end], status_code=206, media_type="text/plain")
+        return Response(content, media_type="text/plain")
+
+    @app.get("/brave/res/v1/web/search")
+    async def brave_search(request: Request):
+        await config.delay(0.5)
+        return replay(request, brave_results, "brave")
+
+    @app.get("/_counts")
+    async def counts():
+        return config.counts
+
+    return app
+
+class FakeUpstream:
+    """Runs the stand-in server on a background thread for the duration of a `with` block."""
+
+    def __init__(self, config: UpstreamConfig, host: str = "127.0.0.1", port: int = 8765):
+        self.config = config
+        self.base_url = f"http://{host}:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(create_app(config), host=host, port=port,
+                                                    log_level="warning", access_log=False))
+        self.thread = threading.Thread(target=self.server.run, name="fake-upstream", daemon=True)
+
+    def env(self) -> dict:
+        """Environment that points the backend at this server."""
+        return {
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "GITHUB_API_URL": f"{self.base_url}/github",
+            "GITHUB_RAW_URL": f"{self.base_url}/raw",
+            "BRAVE_API_URL": f"{self.base_url}/brave",
+        }
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.time() + 10
+        while not self.server.started:
+            if time.time() > deadline or not self.thread.is_alive():
+                raise RuntimeError("Fake upstream server failed to start.")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
@@ -0,0 +1,289 @@
+"""
+Offline benchmarks for the backend's hot paths. Run from backend/:
+
+    python -m bench.run --out bench-results.json
+    python -m bench.run --suites chunking --chunk-sizes 1000,10000,100000
+
+Every upstream (OpenAI, GitHub, Brave) is replaced by bench.fake_upstream, and all
+state (Chroma, caches, checkpoints) lives in a temporary directory. Results are JSON,
+so runs on different commits can be diffed.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import statistics
+
+from bench.fake_upstream import FakeUpstream, UpstreamConfig
+from bench.synthetic_repo import synthetic_repo, mutate, VOCABULARY
+
+SUITES = ("chunking", "indexing", "search", "chat")
+
+# ---------- Measurement helpers ----------
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def percentiles(samples_ms: list) -> dict:
+    if not samples_ms:
+        return {}
+    ordered = sorted(samples_ms)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 3)
+    return {"count": len(ordered), "mean": round(statistics.fmean(ordered), 3),
+            "p50": pick(50), "p95": pick(95), "p99": pick(99), "max": round(ordered[-1], 3)}
+
+class Timer:
+    def __enter__(self):
+        gc.collect()
+        self.rss_before = rss_mb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        self.rss_after = rss_mb()
+
+    def report(self) -> dict:
+        return {"wall_s": round(self.seconds, 3), "rss_before_mb": round(self.rss_before, 1),
+                "rss_after_mb": round(self.rss_after, 1), "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+# ---------- Suites ----------
+def bench_chunking(sizes: list) -> list:
+    from semantic_search import file_chunks
+
+    results = []
+    for size in sizes:
+        files = chunks = total_bytes = 0
+        with Timer() as timer:
+            for path, content in synthetic_repo(size, seed=size):
+                files += 1
+                total_bytes += len(content.encode("utf-8"))
+                for _ in file_chunks(path, content):
+                    chunks += 1
+        results.append({
+            "files": files, "chunks": chunks, "mb": round(total_bytes / 2**20, 2),
+            "files_per_s": round(files / timer.seconds, 1),
+            "chunks_per_s": round(chunks / timer.seconds, 1),
+            "mb_per_s": round(total_bytes / 2**20 / timer.seconds, 3),
+            **timer.report(),
+        })
+        print(f"chunking {size}: {results[-1]}", flush=True)
+    return results
+
+def _upload(machine_id: str, project: str, files: list, deleted: list, incremental: bool) -> dict:
+    from jobs import Job
+    from semantic_search import FileData, index_upload
+
+    payload = {"files": [FileData(path=p, content=c) for p, c in files], "deleted": deleted,
+               "incremental": incremental}
+    return index_upload(Job((machine_id, project), "upload", payload, index_upload))
+
+def bench_indexing(sizes: list, upstream: FakeUpstream) -> list:
+    results = []
+    for size in sizes:
+        project = f"bench-{size}"
+        files = list(synthetic_repo(size, seed=size))
+        entry = {"files": size}
+
+        before = dict(upstream.config.counts)
+        with Timer() as timer:
+            outcome = _upload("bench", project, files, [], incremental=False)
+        entry["full"] = {**outcome, **timer.report(),
+                         "embedding_requests": upstream.config.counts["embeddings"] - before["embeddings"]}
+
+        # ~5% edited and 1% deleted, like a branch switch
+        changed = mutate(files, 0.05)
+        edited = [(p, c) for (p, c), (_, old) in zip(changed, files) if c != old]
+        removed = [p for p, _ in random.Random(size).sample(files, max(1, size // 100))]
+        edited = [(p, c) for p, c in edited if p not in removed]
+        before = dict(upstream.config.counts)
+        with Timer() as timer:
+            outcome = _upload("bench", project, edited, removed, incremental=True)
+        entry["incremental"] = {**outcome, **timer.report(),
+                                "embedding_requests": upstream.config.counts["embeddings"] - before["embeddings"]}
+
+        # Re-sending unchanged files should cost a diff and nothing else
+        with Timer() as timer:
+            outcome = _upload("bench", project, edited, [], incremental=True)
+        entry["noop_incremental"] = {**outcome, **timer.report()}
+
+        results.append(entry)
+        print(f"indexing {size}: {entry}", flush=True)
+    return results
+
+def bench_search(project: str, queries: int) -> dict:
+    from semantic_search import semantic_search, SemanticSearchRequest, search_cache
+
+    rng = random.Random(7)
+    texts = [" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(2, 5))) for _ in range(queries)]
+    identifiers = [f"{rng.choice(VOCABULARY)}_{rng.choice(VOCABULARY)}" for _ in range(queries // 4 or 1)]
+
+    def run(batch: list, **options) -> list:
+        samples = []
+        for text in batch:
+            start = time.perf_counter()
+            semantic_search(SemanticSearchRequest(machineId="bench", projectName=project, query=text, **options))
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    search_cache.clear()
+    result = {
+        "project": project,
+        "cold_ms": percentiles(run(texts)),
+        "warm_ms": percentiles(run(texts)),
+        "identifier_ms": percentiles(run(identifiers)),
+    }
+    search_cache.clear()
+    result["filtered_top10_ms"] = percentiles(run(texts, top_k=10, include=["src/**", "*.py"]))
+    print(f"search: {result}", flush=True)
+    return result
+
+async def _bench_chat(requests: int, concurrency: int, repeat_prompt: bool) -> dict:
+    import httpx
+    import agent
+
+    if agent.chat_graph is None:
+        await agent.init_chat_graph()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    samples, errors = [], 0
+
+    async def one(client, i):
+        nonlocal errors
+        body = {"prompt": "explain this function" if repeat_prompt else f"question {i} about {random.choice(VOCABULARY)}",
+                "selection_text": "def add(a, b):\n    return a + b\n",
+                "no_cache": not repeat_prompt}
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/chat", json=body)
+            samples.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200 or str(response.json().get("reply", "")).startswith("Error"):
+                errors += 1
+
+    transport = httpx.ASGITransport(app=agent.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        if repeat_prompt:
+            # Prime the reply cache so the measured requests are all repeats
+            await one(client, -1)
+            samples.clear()
+            errors = 0
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(requests)))
+        wall = time.perf_counter() - start
+    return {"requests": requests, "concurrency": concurrency, "errors": errors,
+            "throughput_rps": round(requests / wall, 2), "wall_s": round(wall, 3),
+            "latency_ms": percentiles(samples)}
+
+def bench_chat(requests: int, concurrency: int) -> dict:
+    async def both():
+        return {
+            "uncached": await _bench_chat(requests, concurrency, repeat_prompt=False),
+            "reply_cache": await _bench_chat(requests, concurrency, repeat_prompt=True),
+        }
+    result = asyncio.run(both())
+    print(f"chat: {result}", flush=True)
+    return result
+
+# ---------- Entry point ----------
+def _sizes(value: str) -> list:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Scraper.AI backend.")
+    parser.add_argument("--suites", default=",".join(SUITES), help="comma-separated subset of " + ", ".join(SUITES))
+    parser.add_argument("--chunk-sizes", type=_sizes, default=[1000, 10000, 100000])
+    parser.add_argument("--index-sizes", type=_sizes, default=[1000])
+    parser.add_argument("--search-queries", type=int, default=200)
+    parser.add_argument("--chat-requests", type=int, default=100)
+    parser.add_argument("--chat-concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02, help="fraction of OpenAI calls answered with 429")
+    parser.add_argument("--tool-call-rate", type=float, default=0.3, help="fraction of chat turns that call tools")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--out", default=None, help="write results JSON here (also printed)")
+    args = parser.parse_args(argv)
+    suites = [s for s in args.suites.split(",") if s]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    config = UpstreamConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            rate_limit_rate=args.rate_limit_rate, tool_call_rate=args.tool_call_rate)
+    started = time.time()
+    # Chroma, caches and the shared store live in workdir, which is removed when the run ends
+    with tempfile.TemporaryDirectory(prefix="scraper-bench-", ignore_cleanup_errors=True) as workdir, \
+            FakeUpstream(config, port=args.port) as upstream:
+        # Must be set before any backend module is imported: they read their settings at import
+        os.environ.update({
+            **upstream.env(),
+            "OPENAI_API_KEY": "bench",
+            "GITHUB_TOKEN": "bench",
+            "BRAVE_API_KEY": "bench",
+            "CHROMA_ROOT": os.path.join(workdir, "chroma"),
+            "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite3"),
+            "TOOL_CACHE_PATH": os.path.join(workdir, "tool_cache.sqlite3"),
+            "SHARED_STORE_PATH": os.path.join(workdir, "shared_state.sqlite3"),
+            "TOOL_CACHE_DISABLED": "1",
+            "CHECKPOINT_BACKEND": "memory",
+        })
+
+        results = {}
+        if "chunking" in suites:
+            results["chunking"] = bench_chunking(args.chunk_sizes)
+        if "indexing" in suites or "search" in suites:
+            sizes = args.index_sizes if "indexing" in suites else args.index_sizes[-1:]
+            indexing = bench_indexing(sizes, upstream)
+            if "indexing" in suites:
+                results["indexing"] = indexing
+        if "search" in suites:
+            results["search"] = bench_search(f"bench-{args.index_sizes[-1]}", args.search_queries)
+        if "chat" in suites:
+            results["chat"] = bench_chat(args.chat_requests, args.chat_concurrency)
+        upstream_counts = dict(config.counts)
+
+    report = {
+        "meta": {
+            "commit": _commit(),
+            "started_at": started,
+            "duration_s": round(time.time() - started, 3),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "upstream_calls": upstream_counts,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import random
+
+VOCABULARY = [
+    "user", "session", "token", "cache", "parse", "render", "upload", "index", "search", "chunk",
+    "embed", "query", "config", "retry", "stream", "graph", "node", "tool", "router", "request",
+    "response", "error", "handler", "client", "server", "queue", "job", "worker", "metric", "trace",
+    "payment", "invoice", "order", "cart", "profile", "avatar", "email", "password", "login", "logout",
+]
+
+def _name(rng: random.Random, parts: int = 2) -> str:
+    return "_".join(rng.choice(VOCABULARY) for _ in range(parts))
+
+def _python_file(rng: random.Random) -> str:
+    lines = ["import os", "import json", "", ""]
+    for _ in range(rng.randint(3, 12)):
+        if rng.random() < 0.3:
+            cls = "".join(w.title() for w in _name(rng).split("_"))
+            lines += [f"class {cls}:", f'    """Handles {_name(rng, 3).replace("_", " ")}."""', ""]
+            for _ in range(rng.randint(1, 4)):
+                method = _name(rng)
+                lines += [f"    def {method}(self, {rng.choice(VOCABULARY)}):"]
+                lines += [f"        value = self.{_name(rng)}({rng.choice(VOCABULARY)})" for _ in range(rng.randint(2, 10))]
+                lines += ["        return value", ""]
+        else:
+            func = _name(rng)
+            lines += [f"def {func}({rng.choice(VOCABULARY)}, {rng.choice(VOCABULARY)}=None):",
+                      f'    """{_name(rng, 4).replace("_", " ").capitalize()}."""']
+            for _ in range(rng.randint(3, 20)):
+                lines.append(f"    {rng.choice(VOCABULARY)} = {_name(rng)}({rng.choice(VOCABULARY)})")
+            lines += [f"    return {rng.choice(VOCABULARY)}", "", ""]
+    return "\n".join(lines) + "\n"
+
+def _typescript_file(rng: random.Random) -> str:
+    lines = [f"import {{ {_name(rng)} }} from './{rng.choice(VOCABULARY)}';", ""]
+    for _ in range(rng.randint(3, 10)):
+        func = "".join(w.title() if i else w for i, w in enumerate(_name(rng).split("_")))
+        lines += [f"export async function {func}({rng.choice(VOCABULARY)}: string): Promise<number> {{"]
+        for _ in range(rng.randint(3, 15)):
+            lines.append(f"  const {rng.choice(VOCABULARY)}{rng.randint(0, 99)} = await {rng.choice(VOCABULARY)}('{_name(rng)}');")
+        lines += ["  return 0;", "}", ""]
+    return "\n".join(lines) + "\n"
+
+def _markdown_file(rng: random.Random) -> str:
+    lines = [f"# {_name(rng, 2).replace('_', ' ').title()}", ""]
+    for _ in range(rng.randint(2, 6)):
+        lines += [f"## {_name(rng, 2).replace('_', ' ').title()}", ""]
+        lines += [" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(20, 60))), ""]
+    return "\n".join(lines) + "\n"
+
+def synthetic_repo(files: int, seed: int = 0):
+    """Yield (path, content) for a deterministic mixed-language repository of `files` files."""
+    rng = random.Random(seed)
+    for i in range(files):
+        directory = f"{rng.choice(['src', 'lib', 'app', 'docs'])}/{rng.choice(VOCABULARY)}"
+        kind = rng.random()
+        if kind < 0.6:
+            yield f"{directory}/{_name(rng)}_{i}.py", _python_file(rng)
+        elif kind < 0.9:
+            yield f"{directory}/{_name(rng)}_{i}.ts", _typescript_file(rng)
+        else:
+            yield f"{directory}/{_name(rng)}_{i}.md", _markdown_file(rng)
+
+def mutate(files: list, fraction: float, seed: int = 1) -> list:
+    """A copy of (path, content) pairs with `fraction` of the files edited, as after a small branch switch."""
+    rng = random.Random(seed)
+    changed = []
+    for path, content in files:
+        if rng.random() < fraction:
+            lines = content.splitlines()
+            at = rng.randrange(len(lines) + 1)
+            lines[at:at] = [f"# edited: {_name(rng, 3)}"]
+            content = "\n".join(lines) + "\n"
+        changed.append((path, content))
+    return changed
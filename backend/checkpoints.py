@@ -0,0 +1,218 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from shared_store import WEB_CONCURRENCY
+
+# "memory" or "sqlite"; several workers need sqlite, or a conversation only exists in one of them
+CHECKPOINT_BACKEND     = os.getenv("CHECKPOINT_BACKEND") or ("sqlite" if WEB_CONCURRENCY > 1 else "memory")
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", "./checkpoints.sqlite3")
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "1000"))
+CHECKPOINT_TTL_SECONDS = float(os.getenv("CHECKPOINT_TTL_SECONDS", str(6 * 60 * 60)))
+CHECKPOINT_MAX_BYTES   = int(os.getenv("CHECKPOINT_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# ---------- Thread bookkeeping ----------
+class ThreadTracker:
+    """LRU of conversation threads with their last access time and approximate size."""
+
+    def __init__(self, max_threads: int, ttl_seconds: float, max_bytes: Optional[int] = None):
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._threads = OrderedDict()   # thread_id -> [last_access, size_bytes]
+        self._lock = threading.Lock()
+
+    def touch(self, thread_id: str, size_bytes: Optional[int] = None) -> None:
+        with self._lock:
+            entry = self._threads.pop(thread_id, None) or [0.0, 0]
+            entry[0] = time.monotonic()
+            if size_bytes is not None:
+                self.total_bytes += size_bytes - entry[1]
+                entry[1] = size_bytes
+            self._threads[thread_id] = entry
+
+    def forget(self, thread_id: str) -> None:
+        with self._lock:
+            entry = self._threads.pop(thread_id, None)
+            if entry:
+                self.total_bytes -= entry[1]
+
+    def victims(self, keep: Optional[str] = None) -> list:
+        """Threads to evict: expired ones, then least recently used until under count/byte caps."""
+        with self._lock:
+            now = time.monotonic()
+            victims = []
+            count, total = len(self._threads), self.total_bytes
+            for thread_id, (last_access, size) in self._threads.items():
+                if thread_id == keep:
+                    continue
+                expired = now - last_access > self.ttl_seconds
+                over = count > self.max_threads or (self.max_bytes is not None and total > self.max_bytes)
+                if not (expired or over):
+                    # Oldest first: once one entry is fresh and we're under caps, the rest are too
+                    break
+                victims.append(thread_id)
+                count -= 1
+                total -= size
+            return victims
+
+# ---------- In-memory backend ----------
+class BoundedMemorySaver(MemorySaver):
+    """
+    MemorySaver that keeps only the latest checkpoint per thread and evicts whole
+    threads by TTL, LRU count and an approximate byte cap.
+    """
+
+    def __init__(self, max_threads: int = CHECKPOINT_MAX_THREADS,
+                 ttl_seconds: float = CHECKPOINT_TTL_SECONDS,
+                 max_bytes: int = CHECKPOINT_MAX_BYTES, **kwargs):
+        super().__init__(**kwargs)
+        self.tracker = ThreadTracker(max_threads, ttl_seconds, max_bytes)
+        self._channel_versions = {}     # (thread_id, checkpoint_ns) -> channel_versions of latest checkpoint
+        self._lock = threading.RLock()
+
+    def get_tuple(self, config):
+        with self._lock:
+            result = super().get_tuple(config)
+            if result is not None:
+                self.tracker.touch(config["configurable"]["thread_id"])
+            return result
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+            self._prune_history(thread_id, checkpoint_ns, checkpoint)
+            self.tracker.touch(thread_id, self._thread_bytes(thread_id))
+            for victim in self.tracker.victims(keep=thread_id):
+                self.delete_thread(victim)
+            return next_config
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            for key in [k for k in self._channel_versions if k[0] == thread_id]:
+                del self._channel_versions[key]
+            self.tracker.forget(thread_id)
+
+    def _prune_history(self, thread_id: str, checkpoint_ns: str, checkpoint) -> None:
+        # We never time-travel, so older checkpoints, their writes and stale channel blobs are dead weight
+        keep_id = checkpoint["id"]
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in [cid for cid in checkpoints if cid != keep_id]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        current = dict(checkpoint["channel_versions"])
+        previous = self._channel_versions.get((thread_id, checkpoint_ns), {})
+        for channel, version in previous.items():
+            if current.get(channel) != version:
+                self.blobs.pop((thread_id, checkpoint_ns, channel, version), None)
+        self._channel_versions[(thread_id, checkpoint_ns)] = current
+
+    def _thread_bytes(self, thread_id: str) -> int:
+        size = 0
+        for checkpoint_ns, checkpoints in self.storage.get(thread_id, {}).items():
+            for checkpoint_id, (checkpoint, metadata, _parent) in checkpoints.items():
+                size += len(checkpoint[1]) + len(metadata[1])
+                for write in self.writes.get((thread_id, checkpoint_ns, checkpoint_id), {}).values():
+                    size += len(write[2][1])
+            for channel, version in self._channel_versions.get((thread_id, checkpoint_ns), {}).items():
+                blob = self.blobs.get((thread_id, checkpoint_ns, channel, version))
+                if blob:
+                    size += len(blob[1])
+        return size
+
+# ---------- SQLite backend ----------
+def _sqlite_saver_class():
+    # Imported lazily so the in-memory backend works without aiosqlite installed
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    class BoundedSqliteSaver(AsyncSqliteSaver):
+        """
+        On-disk checkpoints (survive restarts), latest checkpoint per thread, TTL/LRU thread eviction.
+        Last access is kept in the database rather than in memory, so every worker sharing
+        the file evicts by the same view of which threads are in use.
+        """
+
+        def __init__(self, conn, max_threads: int = CHECKPOINT_MAX_THREADS,
+                     ttl_seconds: float = CHECKPOINT_TTL_SECONDS, **kwargs):
+            super().__init__(conn, **kwargs)
+            self.max_threads = max_threads
+            self.ttl_seconds = ttl_seconds
+            self._access_ready = False
+
+        async def setup(self):
+            # The base class calls setup() before every operation
+            await super().setup()
+            if self._access_ready:
+                return
+            async with self.lock:
+                await self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS thread_access ("
+                    " thread_id TEXT PRIMARY KEY, last_access REAL NOT NULL)"
+                )
+                await self.conn.commit()
+                self._access_ready = True
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            next_config = await super().aput(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+            async with self.lock, self.conn.cursor() as cur:
+                await cur.execute(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?",
+                    (thread_id, checkpoint_ns, checkpoint["id"]),
+                )
+                await cur.execute(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?",
+                    (thread_id, checkpoint_ns, checkpoint["id"]),
+                )
+                # Every turn writes a checkpoint, so this doubles as the thread's last access
+                await cur.execute(
+                    "INSERT OR REPLACE INTO thread_access (thread_id, last_access) VALUES (?, ?)",
+                    (thread_id, time.time()),
+                )
+                await cur.execute(
+                    "SELECT thread_id FROM thread_access WHERE thread_id != ? AND (last_access < ?"
+                    " OR thread_id IN (SELECT thread_id FROM thread_access ORDER BY last_access DESC LIMIT -1 OFFSET ?))",
+                    (thread_id, time.time() - self.ttl_seconds, self.max_threads),
+                )
+                victims = [row[0] for row in await cur.fetchall()]
+                await self.conn.commit()
+            for victim in victims:
+                await self.adelete_thread(victim)
+            if victims:
+                async with self.lock:
+                    await self.conn.executemany("DELETE FROM thread_access WHERE thread_id = ?",
+                                                [(victim,) for victim in victims])
+                    await self.conn.commit()
+            return next_config
+
+    return BoundedSqliteSaver
+
+async def create_checkpointer():
+    """Build the checkpoint store selected by CHECKPOINT_BACKEND."""
+    if CHECKPOINT_BACKEND == "sqlite":
+        import aiosqlite
+
+        # Workers share the file; wait out each other's write transactions instead of failing
+        conn = await aiosqlite.connect(CHECKPOINT_SQLITE_PATH, timeout=30)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        saver = _sqlite_saver_class()(conn)
+        await saver.setup()
+        return saver
+    if WEB_CONCURRENCY > 1:
+        print("CHECKPOINT_BACKEND=memory with several workers: conversations won't follow requests across them.")
+    return BoundedMemorySaver()
+
+async def close_checkpointer(saver) -> None:
+    conn = getattr(saver, "conn", None)
+    if conn is not None:
+        await conn.close()
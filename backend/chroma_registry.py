@@ -0,0 +1,231 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from chromadb import PersistentClient
+from chromadb.errors import NotFoundError
+from filelock import FileLock
+
+from embeddings import embedding_function
+from metrics import CHROMA_SECONDS
+from shared_store import shared_store
+
+CHROMA_ROOT            = os.getenv("CHROMA_ROOT", "./chroma_db")
+REGISTRY_MAX_CLIENTS   = int(os.getenv("CHROMA_MAX_OPEN_CLIENTS", "32"))
+REGISTRY_IDLE_SECONDS  = float(os.getenv("CHROMA_CLIENT_IDLE_SECONDS", str(15 * 60)))
+# Never close a client younger than this just to get under the count cap; it may still be in use
+REGISTRY_MIN_IDLE_SECONDS = 60
+CHROMA_WRITE_LOCK_TIMEOUT = float(os.getenv("CHROMA_WRITE_LOCK_TIMEOUT", "-1"))    # -1 waits forever
+
+def collection_name(machine_id: str, project_name: str) -> str:
+    return f"{machine_id}-{project_name}"
+
+def _detach_system(client):
+    """
+    Chroma caches one System per path at class level. Take ours out of that cache, so the next
+    PersistentClient for the path loads a fresh one, and return it for _stop_system.
+    """
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+        return SharedSystemClient._identifier_to_system.pop(getattr(client, "_identifier", None), None)
+    except Exception as e:
+        print("Error detaching chroma client:", e)
+        return None
+
+def _stop_system(system) -> None:
+    """Stop a detached System so its memory (segment caches, SQLite connections) is freed."""
+    if system is None:
+        return
+    try:
+        system.stop()
+    except Exception as e:
+        print("Error releasing chroma client:", e)
+
+class TimedCollection:
+    """Collection handle that records every read/write in chroma_operation_seconds."""
+
+    TIMED = ("add", "update", "upsert", "delete", "get", "query", "count")
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in self.TIMED:
+            return attr
+
+        def timed(*args, **kwargs):
+            with CHROMA_SECONDS.time(op=name):
+                return attr(*args, **kwargs)
+        return timed
+
+class _ClientEntry:
+    __slots__ = ("client", "last_used")
+
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.monotonic()
+
+class ChromaRegistry:
+    """
+    Process-wide cache of PersistentClients (one per machineId store) and collection handles,
+    so requests skip reopening SQLite and reloading segment metadata. Idle stores are closed,
+    but never while pinned(): the client cap is soft and busy clients are left open.
+
+    With several workers, writes to a store happen under its write_lock() and every write
+    bumps a generation counter in the shared store. A System keeps its own copy of the vector
+    index in memory, so a worker that sees another worker's write reopens the client; the old
+    System is stopped once no pinned() block on that machineId is left using it.
+    """
+
+    def __init__(self, root: str = CHROMA_ROOT, max_clients: int = REGISTRY_MAX_CLIENTS,
+                 idle_seconds: float = REGISTRY_IDLE_SECONDS):
+        self.root = root
+        self.max_clients = max_clients
+        self.idle_seconds = idle_seconds
+        self._clients = OrderedDict()    # machine_id -> _ClientEntry, least recently used first
+        self._collections = {}           # (machine_id, project_name) -> collection
+        self._seen = {}                  # collection name -> generation our open client reflects
+        self._refs = {}                  # machine_id -> pinned() blocks currently using its store
+        self._retired = {}               # machine_id -> detached Systems waiting for _refs to drop to 0
+        self._lock = threading.RLock()
+
+    def generation(self, name: str) -> int:
+        return int(shared_store.get(f"generation:{name}") or 0)
+
+    def bump(self, name: str) -> None:
+        """Record a write to a collection; anything cached against an older generation is stale."""
+        with self._lock:
+            generation = shared_store.incr(f"generation:{name}")
+            # Only if no other worker wrote in between; otherwise the next get_collection refreshes
+            if self._seen.get(name) == generation - 1:
+                self._seen[name] = generation
+
+    def write_lock(self, machine_id: str) -> FileLock:
+        """
+        Cross-process lock making one worker at a time the writer of a machineId store.
+        A fresh lock per call, so it also excludes other threads; not reentrant.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        return FileLock(f"{self.root}/{machine_id}.lock", timeout=CHROMA_WRITE_LOCK_TIMEOUT, thread_local=False)
+
+    def _entry(self, machine_id: str) -> _ClientEntry:
+        entry = self._clients.pop(machine_id, None)
+        if entry is None:
+            entry = _ClientEntry(PersistentClient(path=f"{self.root}/{machine_id}"))
+        entry.last_used = time.monotonic()
+        self._clients[machine_id] = entry
+        self._evict(keep=machine_id)
+        return entry
+
+    def client(self, machine_id: str):
+        with self._lock:
+            return self._entry(machine_id).client
+
+    def exists(self, machine_id: str) -> bool:
+        """Whether a machineId has a store, without opening (and so creating) one."""
+        with self._lock:
+            return machine_id in self._clients or os.path.isdir(f"{self.root}/{machine_id}")
+
+    @contextmanager
+    def pinned(self, machine_id: str, create: bool = True):
+        """
+        Keep a machineId's client (and any it was replaced by) open for the duration of the
+        block (nestable). With create=False a machineId that never uploaded raises
+        NotFoundError instead of getting an empty store on disk.
+        """
+        with self._lock:
+            if not create and not self.exists(machine_id):
+                raise NotFoundError(f"Collection store for machineId {machine_id} does not exist")
+            self._entry(machine_id)
+            self._refs[machine_id] = self._refs.get(machine_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._refs[machine_id] -= 1
+                entry = self._clients.get(machine_id)
+                if entry is not None:
+                    entry.last_used = time.monotonic()
+                if not self._refs[machine_id]:
+                    del self._refs[machine_id]
+                    for system in self._retired.pop(machine_id, []):
+                        _stop_system(system)
+
+    def get_collection(self, machine_id: str, project_name: str, create: bool = False):
+        """Cached collection handle; raises Chroma's not-found error unless create=True."""
+        key = (machine_id, project_name)
+        name = collection_name(machine_id, project_name)
+        with self._lock:
+            generation = self.generation(name)
+            if name in self._seen and self._seen[name] != generation:
+                # Written by another worker since our client loaded it: its in-memory vector
+                # index is stale, so reopen (anyone mid-query keeps the old one until unpinned)
+                self.invalidate(machine_id)
+            client = self.client(machine_id)
+            collection = self._collections.get(key)
+            if collection is None:
+                self._seen[name] = generation
+                if create:
+                    collection = client.get_or_create_collection(name, embedding_function=embedding_function)
+                else:
+                    collection = client.get_collection(name, embedding_function=embedding_function)
+                collection = self._collections[key] = TimedCollection(collection)
+            return collection
+
+    def reset_collection(self, machine_id: str, project_name: str):
+        """Drop and recreate a collection (full rebuild)."""
+        with self._lock:
+            try:
+                self.delete_collection(machine_id, project_name)
+            except Exception:
+                pass
+            name = collection_name(machine_id, project_name)
+            self._seen[name] = self.generation(name)
+            collection = TimedCollection(self.client(machine_id).create_collection(
+                name=name,
+                embedding_function=embedding_function
+            ))
+            self._collections[(machine_id, project_name)] = collection
+            return collection
+
+    def delete_collection(self, machine_id: str, project_name: str) -> None:
+        """Delete a collection and its cached handle; raises Chroma's error if it doesn't exist."""
+        with self._lock:
+            self._collections.pop((machine_id, project_name), None)
+            self.bump(collection_name(machine_id, project_name))
+            self.client(machine_id).delete_collection(name=collection_name(machine_id, project_name))
+
+    def invalidate(self, machine_id: str, project_name: str = None) -> None:
+        with self._lock:
+            if project_name is not None:
+                self._collections.pop((machine_id, project_name), None)
+                return
+            for key in [k for k in self._collections if k[0] == machine_id]:
+                del self._collections[key]
+                self._seen.pop(collection_name(*key), None)
+            entry = self._clients.pop(machine_id, None)
+            if entry is None:
+                return
+            system = _detach_system(entry.client)
+            if self._refs.get(machine_id):
+                # Stopping the System now would break the uploads/searches still using it
+                self._retired.setdefault(machine_id, []).append(system)
+            else:
+                _stop_system(system)
+
+    def _evict(self, keep: str = None) -> None:
+        now = time.monotonic()
+        for machine_id, entry in list(self._clients.items()):
+            if self._refs.get(machine_id) or machine_id == keep:
+                continue    # busy clients stay open, even over the cap
+            idle = now - entry.last_used
+            over_cap = len(self._clients) > self.max_clients and idle > REGISTRY_MIN_IDLE_SECONDS
+            if idle > self.idle_seconds or over_cap:
+                self.invalidate(machine_id)
+            else:
+                break   # LRU order: everything after this was used more recently
+
+registry = ChromaRegistry()
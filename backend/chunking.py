@@ -0,0 +1,259 @@
+import io
+import os
+import re
+import ast
+from typing import NamedTuple
+
+import tiktoken
+
+# Budgets are in embedding-model tokens, not characters
+CHUNK_MAX_TOKENS    = int(os.getenv("CHUNK_MAX_TOKENS", "400"))
+# A new definition starts a new chunk once the current one has at least this many tokens
+CHUNK_MIN_TOKENS    = int(os.getenv("CHUNK_MIN_TOKENS", "100"))
+# Above this, Python files are split by the indentation scanner instead of a full parse
+CHUNK_AST_MAX_BYTES = int(os.getenv("CHUNK_AST_MAX_BYTES", str(1024 * 1024)))
+
+try:
+    ENCODING = tiktoken.encoding_for_model(os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002"))
+except KeyError:
+    ENCODING = tiktoken.get_encoding("cl100k_base")
+
+# Cut levels: a chunk is preferably cut before the highest-level line it contains
+TOP_DEFINITION    = 4
+NESTED_DEFINITION = 3
+TOP_STATEMENT     = 2
+AFTER_BLANK       = 1
+
+PYTHON_EXTS = {".py", ".pyi", ".pyw"}
+BRACE_EXTS  = {".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".java", ".kt", ".cs", ".go",
+               ".c", ".h", ".cpp", ".hpp", ".cc", ".rs", ".swift", ".php", ".scala"}
+MARKDOWN_EXTS = {".md", ".mdx", ".rst"}
+
+PY_DEF_RE = re.compile(r"\s*(async\s+def|def|class)\s")
+BRACE_DEF_RE = re.compile(
+    r"\s*(export\s+)?(default\s+)?"
+    r"((public|private|protected|internal|static|final|abstract|async|override|sealed|virtual|readonly)\s+)*"
+    r"(function\b|class\b|interface\b|enum\b|record\b|struct\b|impl\b|fn\b|func\b|type\s+\w+\s*=|"
+    r"(const|let|var)\s+\w+\s*=\s*(async\s+)?(\([^)]*\)|\w+)\s*=>|"
+    r"[\w<>\[\],.?]+\s+\w+\s*\([^;]*$)"
+)
+
+class Chunk(NamedTuple):
+    text: str
+    line_start: int     # 1-based, inclusive
+    line_end: int
+    byte_start: int     # UTF-8 offsets into the file, end exclusive
+    byte_end: int
+
+def count_tokens(text: str) -> int:
+    return len(ENCODING.encode_ordinary(text))
+
+def _extension(file_path: str) -> str:
+    name = file_path.replace("\\", "/").rsplit("/", 1)[-1]
+    return ("." + name.rsplit(".", 1)[1].lower()) if "." in name else ""
+
+# ---------- Cut points per language ----------
+def _python_ast_levels(source: str):
+    """Line -> cut level from the parse tree; None if the file doesn't parse."""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+    levels = {}
+
+    def mark(line, level):
+        if levels.get(line, 0) < level:
+            levels[line] = level
+
+    def visit(body, depth):
+        for node in body:
+            start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                mark(start, TOP_DEFINITION if depth == 0 else NESTED_DEFINITION)
+                visit(node.body, depth + 1)
+            else:
+                mark(start, TOP_STATEMENT if depth == 0 else AFTER_BLANK)
+    visit(tree.body, 0)
+    return levels
+
+class _PythonScanner:
+    """Indentation-based cut levels, for files too large to parse or that don't parse."""
+
+    leaders = ("#", "@")
+
+    def __init__(self, levels=None):
+        self.levels = levels
+        self.previous_blank = False
+        self.continued = False
+
+    def level(self, line_no: int, line: str) -> int:
+        if self.levels is not None:
+            return self.levels.get(line_no, 0)
+        stripped = line.strip()
+        blank = not stripped
+        level = 0
+        if not blank and not self.continued:
+            indented = line[:1].isspace()
+            if PY_DEF_RE.match(line) or stripped.startswith("@"):
+                level = NESTED_DEFINITION if indented else TOP_DEFINITION
+            elif not indented:
+                level = TOP_STATEMENT
+            elif self.previous_blank:
+                level = AFTER_BLANK
+        if not blank:
+            self.continued = stripped.endswith(("\\", "(", "[", "{", ","))
+        self.previous_blank = blank
+        return level
+
+class _BraceScanner:
+    """
+    Cut levels for C-family languages from brace depth. Strings and comments are skipped
+    so braces inside them don't count; regex and template literals are best effort.
+    """
+
+    leaders = ("//", "/*", "*", "@", "#[")
+
+    def __init__(self):
+        self.depth = 0
+        self.in_block_comment = False
+        self.previous_blank = False
+
+    def level(self, line_no: int, line: str) -> int:
+        stripped = line.strip()
+        level = 0
+        if stripped and not self.in_block_comment:
+            if self.depth == 0:
+                level = TOP_DEFINITION if BRACE_DEF_RE.match(line) else TOP_STATEMENT
+                if stripped.startswith(("}", ")", "]", ".")):
+                    level = 0
+            elif self.depth == 1 and BRACE_DEF_RE.match(line):
+                level = NESTED_DEFINITION
+            elif self.previous_blank:
+                level = AFTER_BLANK
+        self.previous_blank = not stripped
+        self._track(line)
+        return level
+
+    def _track(self, line: str) -> None:
+        i, n, quote = 0, len(line), None
+        while i < n:
+            c = line[i]
+            if self.in_block_comment:
+                if line.startswith("*/", i):
+                    self.in_block_comment = False
+                    i += 1
+            elif quote:
+                if c == "\\":
+                    i += 1
+                elif c == quote:
+                    quote = None
+            elif line.startswith("//", i):
+                return
+            elif line.startswith("/*", i):
+                self.in_block_comment = True
+                i += 1
+            elif c in "\"'`":
+                quote = c
+            elif c == "{":
+                self.depth += 1
+            elif c == "}":
+                self.depth = max(0, self.depth - 1)
+            i += 1
+
+class _TextScanner:
+    leaders = ()
+
+    def __init__(self, markdown: bool):
+        self.markdown = markdown
+        self.previous_blank = False
+
+    def level(self, line_no: int, line: str) -> int:
+        stripped = line.strip()
+        level = 0
+        if self.markdown and stripped.startswith("#"):
+            level = TOP_DEFINITION
+        elif stripped and self.previous_blank:
+            level = AFTER_BLANK
+        self.previous_blank = not stripped
+        return level
+
+def _scanner(file_path: str, source):
+    ext = _extension(file_path)
+    if ext in PYTHON_EXTS:
+        levels = None
+        if isinstance(source, str) and len(source) <= CHUNK_AST_MAX_BYTES:
+            levels = _python_ast_levels(source)
+        return _PythonScanner(levels)
+    if ext in BRACE_EXTS:
+        return _BraceScanner()
+    return _TextScanner(ext in MARKDOWN_EXTS)
+
+def _is_leader(line: str, leaders: tuple) -> bool:
+    """Comments, decorators and annotations belong with the definition below them."""
+    stripped = line.strip()
+    return bool(leaders) and stripped.startswith(leaders) and not stripped.startswith("#!")
+
+# ---------- Chunking ----------
+def iter_chunks(file_path: str, source, max_tokens: int = CHUNK_MAX_TOKENS, min_tokens: int = CHUNK_MIN_TOKENS):
+    """
+    Yield Chunks of a file, cut at function/class boundaries where possible and kept under
+    max_tokens. Chunks don't overlap; together they cover every non-blank line exactly once.
+    `source` may be a string or any iterable of lines (with line endings), e.g. an open file,
+    in which case only the current chunk is held in memory.
+    """
+    scanner = _scanner(file_path, source)
+    lines = io.StringIO(source) if isinstance(source, str) else source
+
+    buffer = []         # [text, tokens, line_no, byte_start, byte_end]
+    buffer_tokens = 0
+    cuts = []           # (index into buffer, level): preferred places to end the current chunk
+    byte_offset = 0
+
+    def emit(count):
+        nonlocal buffer, buffer_tokens, cuts
+        taken, buffer = buffer[:count], buffer[count:]
+        buffer_tokens -= sum(entry[1] for entry in taken)
+        cuts = [(i - count, level) for i, level in cuts if i > count]
+        # Blank edges carry no meaning and would only shift the reported line range
+        while taken and not taken[0][0].strip():
+            taken.pop(0)
+        while taken and not taken[-1][0].strip():
+            taken.pop()
+        if taken:
+            yield Chunk("".join(entry[0] for entry in taken), taken[0][2], taken[-1][2], taken[0][3], taken[-1][4])
+
+    for line_no, line in enumerate(lines, 1):
+        size = len(line.encode("utf-8"))
+        tokens = count_tokens(line)
+        level = scanner.level(line_no, line)
+
+        if level and buffer:
+            cut = len(buffer)
+            while cut > 0 and _is_leader(buffer[cut - 1][0], scanner.leaders):
+                cut -= 1
+            if level >= NESTED_DEFINITION and buffer_tokens >= min_tokens and cut > 0:
+                yield from emit(cut)
+            elif cut > 0:
+                cuts.append((cut, level))
+
+        if tokens > max_tokens:
+            # A single enormous line (minified code, data): flush, then split it by characters
+            yield from emit(len(buffer))
+            step = max(1, len(line) * max_tokens // tokens)
+            for start in range(0, len(line), step):
+                piece = line[start:start + step]
+                piece_size = len(piece.encode("utf-8"))
+                if piece.strip():
+                    yield Chunk(piece, line_no, line_no, byte_offset, byte_offset + piece_size)
+                byte_offset += piece_size
+            continue
+
+        if buffer_tokens + tokens > max_tokens and buffer:
+            best = max(cuts, key=lambda c: (c[1], c[0]), default=None)
+            yield from emit(best[0] if best else len(buffer))
+
+        buffer.append([line, tokens, line_no, byte_offset, byte_offset + size])
+        buffer_tokens += tokens
+        byte_offset += size
+
+    yield from emit(len(buffer))
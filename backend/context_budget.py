@@ -0,0 +1,199 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import tiktoken
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "24000"))
+OLD_TOOL_OUTPUT_CHARS = int(os.getenv("OLD_TOOL_OUTPUT_CHARS", "600"))
+SUMMARY_LINE_CHARS = 200
+IMAGE_PART_TOKENS = 765             # OpenAI's cost for a high-detail 512px tile image
+MESSAGE_OVERHEAD_TOKENS = 4         # role + separators per chat message
+
+FILE_CONTEXT_PREFIX = "File Context:"
+SUMMARY_PREFIX = "Summary of earlier conversation"
+
+ENCODING = tiktoken.get_encoding("o200k_base")   # gpt-4o tokenizer
+
+# ---------- Token counting ----------
+TOKEN_COUNT_CACHE_SIZE = 1024
+_token_counts = OrderedDict()      # (sha1 digest, length) -> token count
+_token_counts_lock = threading.Lock()
+
+def count_text_tokens(text: str) -> int:
+    # Keyed by a digest rather than the text, so the cache doesn't keep whole file contexts alive
+    key = (hashlib.sha1(text.encode("utf-8", "surrogatepass")).digest(), len(text))
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+        if count is not None:
+            _token_counts.move_to_end(key)
+            return count
+    count = len(ENCODING.encode(text, disallowed_special=()))
+    with _token_counts_lock:
+        _token_counts[key] = count
+        if len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+    return count
+
+def count_message_tokens(message) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    content = message.content
+    if isinstance(content, str):
+        tokens += count_text_tokens(content)
+    else:
+        for part in content:
+            if isinstance(part, str):
+                tokens += count_text_tokens(part)
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_PART_TOKENS
+            else:
+                tokens += count_text_tokens(part.get("text", ""))
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += count_text_tokens(tool_call["name"] + json.dumps(tool_call["args"]))
+    return tokens
+
+def count_tokens(messages: list) -> int:
+    return sum(count_message_tokens(m) for m in messages)
+
+# ---------- Helpers ----------
+def _text_of(message) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return " ".join(p if isinstance(p, str) else p.get("text", "") for p in content)
+
+def _first_line(text: str) -> str:
+    line = text.strip().splitlines()[0] if text.strip() else ""
+    return line[:SUMMARY_LINE_CHARS]
+
+def _copy(message, content):
+    return message.model_copy(update={"content": content})
+
+def _split_turns(messages: list):
+    """Split history into (preamble, turns); a turn starts at each new run of HumanMessages."""
+    preamble = []
+    i = 0
+    while i < len(messages) and isinstance(messages[i], SystemMessage):
+        preamble.append(messages[i])
+        i += 1
+    turns = []
+    for message in messages[i:]:
+        starts_turn = isinstance(message, HumanMessage) and (
+            not turns or not isinstance(turns[-1][-1], HumanMessage)
+        )
+        if starts_turn or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return preamble, turns
+
+def close_dangling_tool_calls(messages: list) -> list:
+    """
+    A turn cancelled between the model's tool calls and the tools running (client disconnect,
+    stream cancelled) leaves calls with no ToolMessage in the thread, and the API rejects every
+    later prompt containing them. Answer each such call with a placeholder result.
+    """
+    result, pending, closed = [], [], False
+    for message in messages + [None]:
+        if isinstance(message, ToolMessage):
+            pending = [call for call in pending if call["id"] != message.tool_call_id]
+        else:
+            for call in pending:
+                result.append(ToolMessage(content="Cancelled: the turn ended before this tool ran.",
+                                          tool_call_id=call["id"], name=call["name"]))
+                closed = True
+            pending = list(message.tool_calls or []) if isinstance(message, AIMessage) else []
+        if message is not None:
+            result.append(message)
+    return result if closed else messages
+
+def _compress_old_message(message):
+    """Shrink a message from a finished turn: tool outputs are truncated, images dropped."""
+    if isinstance(message, ToolMessage):
+        text = _text_of(message)
+        if len(text) > OLD_TOOL_OUTPUT_CHARS:
+            return _copy(message, text[:OLD_TOOL_OUTPUT_CHARS] +
+                         f"... [tool output truncated, {len(text) - OLD_TOOL_OUTPUT_CHARS} chars omitted]")
+        return message
+    if not isinstance(message.content, str):
+        parts = [
+            {"type": "text", "text": "[image omitted]"} if isinstance(p, dict) and p.get("type") == "image_url" else p
+            for p in message.content
+        ]
+        return _copy(message, parts)
+    return message
+
+def _summarize_turns(turns: list) -> SystemMessage:
+    lines = []
+    for turn in turns:
+        asked = next((_first_line(_text_of(m)) for m in turn if isinstance(m, HumanMessage)), "")
+        answered = next((_first_line(_text_of(m)) for m in reversed(turn)
+                         if isinstance(m, AIMessage) and not m.tool_calls), "")
+        lines.append(f"- User: {asked} -> Assistant: {answered}")
+    return SystemMessage(content=f"{SUMMARY_PREFIX} (older turns were trimmed):\n" + "\n".join(lines))
+
+def _truncate_to_tokens(message, max_tokens: int):
+    tokens = ENCODING.encode(_text_of(message), disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return message
+    return _copy(message, ENCODING.decode(tokens[:max_tokens]) + "\n... [truncated to fit context budget]")
+
+# ---------- Budgeter ----------
+def fit_to_budget(messages: list, budget: int = CONTEXT_TOKEN_BUDGET) -> list:
+    """
+    Shape the history sent to the model so it stays under `budget` tokens.
+    The checkpointed history is left untouched; only the outgoing prompt is trimmed.
+    """
+    messages = close_dangling_tool_calls(messages)
+    preamble, turns = _split_turns(messages)
+    if not turns:
+        return messages
+
+    # 1) The same file pasted on several turns only needs to be seen once, in its latest position
+    seen_file_contexts = set()
+    deduped = []
+    for turn in reversed(turns):
+        kept = []
+        for m in reversed(turn):
+            if isinstance(m, HumanMessage) and isinstance(m.content, str) and m.content.startswith(FILE_CONTEXT_PREFIX):
+                if m.content in seen_file_contexts:
+                    continue
+                seen_file_contexts.add(m.content)
+            kept.append(m)
+        deduped.append(list(reversed(kept)))
+    turns = list(reversed(deduped))
+
+    # 2) Finished turns keep their shape but lose bulky tool outputs and images
+    turns = [[_compress_old_message(m) for m in turn] for turn in turns[:-1]] + [turns[-1]]
+
+    # 3) Drop whole turns, oldest first, until we fit; tool calls stay paired with their outputs
+    dropped = []
+    while len(turns) > 1 and count_tokens(preamble) + sum(count_tokens(t) for t in turns) > budget:
+        dropped.append(turns.pop(0))
+    summary = [_summarize_turns(dropped)] if dropped else []
+
+    current = turns[-1]
+    result = preamble + summary + [m for turn in turns for m in turn]
+
+    # 4) A single oversized turn: shrink its largest pasted contexts / tool outputs
+    overflow = count_tokens(result) - budget
+    if overflow > 0:
+        head = result[:len(result) - len(current)]
+        largest = sorted(
+            (i for i, m in enumerate(current)
+             if isinstance(m, (HumanMessage, ToolMessage)) and isinstance(m.content, str)),
+            key=lambda i: count_message_tokens(current[i]),
+            reverse=True,
+        )
+        current = list(current)
+        for i in largest:
+            if overflow <= 0:
+                break
+            size = count_message_tokens(current[i])
+            current[i] = _truncate_to_tokens(current[i], max(size - overflow, size // 10))
+            overflow -= size - count_message_tokens(current[i])
+        result = head + current
+
+    return result
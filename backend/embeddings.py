@@ -0,0 +1,254 @@
+import os
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openai
+import tiktoken
+from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+
+from openai_clients import get_openai_client, OPENAI_BASE_URL
+from metrics import EMBEDDING_SECONDS, EMBEDDING_INPUTS
+
+EMBEDDING_MODEL      = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3")
+SQLITE_MAX_PARAMS    = 500
+
+# Requests are sized by tokens (the API caps inputs per request and bills/limits by tokens)
+EMBED_MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "20000"))
+EMBED_MAX_BATCH_INPUTS = 2048
+EMBED_MAX_INPUT_TOKENS = 8191
+EMBED_MAX_CONCURRENCY  = int(os.getenv("EMBED_MAX_CONCURRENCY", "8"))
+EMBED_MAX_RETRIES      = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_BACKOFF_MAX      = 30.0
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+
+# Used by Chroma for query embeddings and by embed_texts for documents; both must use the same model
+embedding_function = OpenAIEmbeddingFunction(api_key=os.environ["OPENAI_API_KEY"], model_name=EMBEDDING_MODEL,
+                                             api_base=OPENAI_BASE_URL)
+
+# Retries are ours (AdaptiveLimiter), not the SDK's, so 429s also shrink concurrency
+openai_client = get_openai_client().with_options(max_retries=0)
+
+try:
+    ENCODING = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+except KeyError:
+    ENCODING = tiktoken.get_encoding("cl100k_base")
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# ---------- Persistent cache ----------
+class EmbeddingCache:
+    """
+    Embeddings keyed by (model, sha256 of chunk text). Shared by every project and machine
+    collection, so vendored files and full rebuilds don't pay for the same vectors twice.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, hash)) WITHOUT ROWID"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get_many(self, model: str, hashes: list) -> dict:
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(hashes), SQLITE_MAX_PARAMS):
+                batch = hashes[i:i + SQLITE_MAX_PARAMS]
+                rows = conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, items: dict) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items.items()],
+            )
+            conn.commit()
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+
+# ---------- Rate-aware request pipeline ----------
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for embedding requests: grows by one after a run of
+    successful requests, halves and pauses everyone on a 429.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = max(1, self.max_limit // 2)
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, throttled: bool = False, retry_after: float = 0.0) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self.successes = 0
+            self._cond.notify_all()
+
+limiter = AdaptiveLimiter(EMBED_MAX_CONCURRENCY)
+embed_pool = ThreadPoolExecutor(max_workers=EMBED_MAX_CONCURRENCY, thread_name_prefix="embed")
+
+def _retry_after(error: openai.APIStatusError, attempt: int) -> float:
+    headers = error.response.headers if error.response is not None else {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return random.uniform(0, min(EMBED_BACKOFF_MAX, 0.5 * (2 ** attempt)))
+
+def _embed_request(texts: list) -> list:
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = openai_client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+        except openai.RateLimitError as e:
+            EMBEDDING_SECONDS.observe(time.perf_counter() - start, status="throttled")
+            if attempt == EMBED_MAX_RETRIES:
+                limiter.release(throttled=True)
+                raise
+            limiter.release(throttled=True, retry_after=_retry_after(e, attempt))
+            continue
+        except (openai.APIConnectionError, openai.InternalServerError):
+            EMBEDDING_SECONDS.observe(time.perf_counter() - start, status="error")
+            limiter.release()
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            time.sleep(random.uniform(0, min(EMBED_BACKOFF_MAX, 0.5 * (2 ** attempt))))
+            continue
+        except Exception:
+            EMBEDDING_SECONDS.observe(time.perf_counter() - start, status="error")
+            limiter.release()
+            raise
+        EMBEDDING_SECONDS.observe(time.perf_counter() - start, status="ok")
+        EMBEDDING_INPUTS.inc(len(texts))
+        limiter.release()
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+def _token_batches(texts: list) -> list:
+    """Group texts into requests under EMBED_MAX_BATCH_TOKENS / EMBED_MAX_BATCH_INPUTS."""
+    batches, batch, batch_tokens = [], [], 0
+    for text in texts:
+        tokens = ENCODING.encode(text, disallowed_special=())
+        if len(tokens) > EMBED_MAX_INPUT_TOKENS:
+            text = ENCODING.decode(tokens[:EMBED_MAX_INPUT_TOKENS])
+        n = min(len(tokens), EMBED_MAX_INPUT_TOKENS)
+        if batch and (batch_tokens + n > EMBED_MAX_BATCH_TOKENS or len(batch) >= EMBED_MAX_BATCH_INPUTS):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += n
+    if batch:
+        batches.append(batch)
+    return batches
+
+# ---------- Document embeddings ----------
+def embed_texts(texts: list) -> list:
+    """
+    Embeddings for texts in order. Only texts never seen before (for this model) hit the API,
+    as token-sized requests running concurrently under the adaptive limit.
+    """
+    hashes = [text_hash(t) for t in texts]
+    vectors = embedding_cache.get_many(EMBEDDING_MODEL, list(set(hashes)))
+
+    missing = {}
+    for h, t in zip(hashes, texts):
+        if h not in vectors:
+            missing[h] = t
+    embedding_cache.hits += len(texts) - len(missing)
+    embedding_cache.misses += len(missing)
+
+    if missing:
+        missing_hashes = list(missing)
+        batches = _token_batches([missing[h] for h in missing_hashes])
+        computed = [v for batch in embed_pool.map(_embed_request, batches) for v in batch]
+        fresh = dict(zip(missing_hashes, computed))
+        embedding_cache.put_many(EMBEDDING_MODEL, fresh)
+        vectors.update({h: np.asarray(v, dtype=np.float32) for h, v in fresh.items()})
+
+    return [vectors[h] for h in hashes]
+
+# ---------- Query embeddings ----------
+_query_vectors = OrderedDict()      # (model, normalized query) -> vector
+_query_lock = threading.Lock()
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.split())
+
+def embed_queries(texts: list) -> list:
+    """
+    Query embeddings from an in-process LRU, then the persistent cache, then the API.
+    All misses go out together, so a batch of queries costs at most one embedding call.
+    """
+    keys = [(EMBEDDING_MODEL, normalize_query(t)) for t in texts]
+    vectors = {}
+    with _query_lock:
+        for key in keys:
+            vector = _query_vectors.get(key)
+            if vector is not None:
+                _query_vectors.move_to_end(key)
+                vectors[key] = vector
+    missing = list(dict.fromkeys(k for k in keys if k not in vectors))
+    if missing:
+        computed = embed_texts([k[1] for k in missing])
+        with _query_lock:
+            for key, vector in zip(missing, computed):
+                vectors[key] = vector
+                _query_vectors[key] = vector
+            while len(_query_vectors) > QUERY_EMBEDDING_CACHE_SIZE:
+                _query_vectors.popitem(last=False)
+    return [vectors[k] for k in keys]
+
+def embed_query(text: str):
+    return embed_queries([text])[0]
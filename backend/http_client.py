@@ -0,0 +1,172 @@
+import os
+import time
+import random
+import threading
+import contextvars
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import UPSTREAM_SECONDS, record_stage
+
+HTTP_CONNECT_TIMEOUT   = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT      = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+HTTP_MAX_CONNECTIONS   = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE     = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_MAX_PER_HOST      = int(os.getenv("HTTP_MAX_PER_HOST", "10"))
+HTTP_KEEPALIVE_EXPIRY  = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_MAX_RETRIES       = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE      = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX       = float(os.getenv("HTTP_BACKOFF_MAX", "20"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.RemoteProtocolError)
+
+TIMEOUT = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+LIMITS = httpx.Limits(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+)
+
+_lock = threading.Lock()
+_sync_client = None
+_host_semaphores = {}
+
+# ---------- Deadlines ----------
+class Deadline:
+    """
+    Time budget and cancel switch for the upstream requests made by one tool call.
+    A tool abandoned by its caller (timeout, client disconnect) stops at its next request
+    or retry wait instead of holding a worker thread for the full retry budget.
+    """
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def remaining(self) -> float:
+        return 0.0 if self._cancelled.is_set() else max(0.0, self.expires_at - time.monotonic())
+
+    def sleep(self, seconds: float) -> None:
+        if self._cancelled.wait(seconds):
+            raise DeadlineExceeded("Cancelled while waiting to retry.")
+
+class DeadlineExceeded(Exception):
+    pass
+
+# Set around a tool call by BasicToolNode; None means no limit beyond the client timeouts
+current_deadline = contextvars.ContextVar("http_deadline", default=None)
+
+# ---------- Shared clients ----------
+def get_client() -> httpx.Client:
+    """Process-wide pooled client for blocking code (tools run on worker threads)."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            _sync_client = httpx.Client(timeout=TIMEOUT, limits=LIMITS, follow_redirects=True)
+        return _sync_client
+
+async def close_clients() -> None:
+    global _sync_client
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
+
+# httpx only limits connections globally, so per-host fairness is enforced here
+def _host_semaphore(url: str) -> threading.BoundedSemaphore:
+    host = urlsplit(url).netloc
+    with _lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(HTTP_MAX_PER_HOST)
+        return _host_semaphores[host]
+
+# ---------- Retry policy ----------
+def _retry_after(response: httpx.Response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _retry_delay(attempt: int, response: httpx.Response = None, deadline: Deadline = None):
+    """Seconds to wait before the next attempt, or None if we should give up."""
+    if attempt >= HTTP_MAX_RETRIES:
+        return None
+    retry_after = _retry_after(response) if response is not None else None
+    if retry_after is not None:
+        # Don't tie up a worker for a rate-limit window longer than our backoff cap
+        delay = retry_after if retry_after <= HTTP_BACKOFF_MAX else None
+    else:
+        # Full jitter exponential backoff
+        delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+    if delay is not None and deadline is not None and delay >= deadline.remaining():
+        return None     # the retry couldn't finish before the caller gives up
+    return delay
+
+# ---------- Requests ----------
+def _observe(url: str, start: float, status) -> None:
+    elapsed = time.perf_counter() - start
+    host = urlsplit(url).netloc
+    UPSTREAM_SECONDS.observe(elapsed, host=host, status=status)
+    record_stage("upstream", elapsed, host=host)
+
+def _acquire(semaphore: threading.BoundedSemaphore, deadline: Deadline) -> None:
+    if deadline is None:
+        semaphore.acquire()
+    elif not semaphore.acquire(timeout=deadline.remaining()):
+        raise DeadlineExceeded("Out of time waiting for a connection slot.")
+
+def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a request on the shared client, retrying 429/5xx and transient network errors.
+    Under a current_deadline, timeouts and retries are cut to the time left and a
+    cancelled deadline raises DeadlineExceeded before the next attempt.
+    """
+    client = get_client()
+    deadline = current_deadline.get()
+    semaphore = _host_semaphore(url)
+    attempt = 0
+    while True:
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{method} {url}: tool call cancelled or out of time.")
+            kwargs["timeout"] = httpx.Timeout(min(HTTP_READ_TIMEOUT, remaining),
+                                              connect=min(HTTP_CONNECT_TIMEOUT, remaining))
+        _acquire(semaphore, deadline)
+        try:
+            start = time.perf_counter()
+            response = client.request(method, url, **kwargs)
+        except RETRY_EXCEPTIONS as e:
+            _observe(url, start, type(e).__name__)
+            delay = _retry_delay(attempt, deadline=deadline)
+            if delay is None:
+                raise
+        else:
+            _observe(url, start, response.status_code)
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            delay = _retry_delay(attempt, response, deadline)
+            if delay is None:
+                return response
+        finally:
+            semaphore.release()
+        if deadline is not None:
+            deadline.sleep(delay)
+        else:
+            time.sleep(delay)
+        attempt += 1
+
+def get(url: str, **kwargs) -> httpx.Response:
+    return request("GET", url, **kwargs)
@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+
+from shared_store import shared_store
+
+JOB_WORKERS      = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_FINISHED = int(os.getenv("JOB_MAX_FINISHED", "256"))   # finished jobs kept for status polling
+JOB_FINISHED_TTL = float(os.getenv("JOB_FINISHED_TTL", str(60 * 60)))
+# Progress is published to the shared store (and remote cancels picked up) at most this often
+JOB_PUBLISH_INTERVAL = float(os.getenv("JOB_PUBLISH_INTERVAL", "1"))
+# Cross-worker lease per project, renewed while the job runs; a crashed worker's lease lapses after this
+JOB_LEASE_TTL    = float(os.getenv("JOB_LEASE_TTL", "300"))
+JOB_LEASE_POLL   = 0.5
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED, SUPERSEDED = (
+    "queued", "running", "succeeded", "failed", "cancelled", "superseded"
+)
+FINISHED = {SUCCEEDED, FAILED, CANCELLED, SUPERSEDED}
+
+class JobCancelled(Exception):
+    pass
+
+def job_prefix(key: tuple) -> str:
+    return f"job:{key[0]}:{key[1]}:"
+
+def lease_key(key: tuple) -> str:
+    return f"job-lease:{key[0]}:{key[1]}"
+
+class Job:
+    """
+    One unit of background work. `run(job)` receives the job so it can report progress
+    and call check_cancelled() at safe points; its return value becomes the result.
+    """
+
+    def __init__(self, key: tuple, kind: str, payload, run):
+        self.id = str(uuid.uuid4())
+        self.key = key
+        self.kind = kind
+        self.payload = payload
+        self.run = run
+        self.status = QUEUED
+        self.stage = "queued"
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.superseded_by = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._published_at = 0.0
+        self._cancel_checked_at = time.monotonic()
+        self._publish_lock = threading.Lock()   # the last write to the shared store reflects the latest state
+
+    def report(self, stage: str, done: int = None, total: int = None) -> None:
+        self.stage = stage
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if time.monotonic() - self._published_at >= JOB_PUBLISH_INTERVAL:
+            self.publish()
+
+    def check_cancelled(self) -> None:
+        if not self._cancel.is_set() and time.monotonic() - self._cancel_checked_at >= JOB_PUBLISH_INTERVAL:
+            # A cancel sent to another worker arrives through the shared store
+            self._cancel_checked_at = time.monotonic()
+            if shared_store.get(f"job-cancel:{self.id}"):
+                self._cancel.set()
+            elif self.status == RUNNING and self.stage != "waiting":
+                self.renew_lease()
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def acquire_lease(self) -> bool:
+        return shared_store.acquire(lease_key(self.key), self.id, JOB_LEASE_TTL)
+
+    def renew_lease(self) -> None:
+        if not self.acquire_lease():
+            print(f"Job {self.id} lost its lease on {self.key}; another worker may be writing too")
+
+    def release_lease(self) -> None:
+        try:
+            shared_store.release(lease_key(self.key), self.id)
+        except Exception as e:
+            print(f"Error releasing lease of job {self.id}:", e)
+
+    @property
+    def record_key(self) -> str:
+        # Grouped by project so statuses_for is a prefix scan rather than a scan of every job
+        return f"{job_prefix(self.key)}{self.id}"
+
+    def publish(self) -> None:
+        """
+        Share this job's status, since with several workers a poll can land on any of them.
+        Shared-store I/O: never call it while holding the queue's condition.
+        """
+        with self._publish_lock:
+            first = not self._published_at
+            self._published_at = time.monotonic()
+            try:
+                shared_store.set(self.record_key, json.dumps(self.to_dict(), default=str), JOB_FINISHED_TTL)
+                if first or self.status in FINISHED:
+                    # Lets status(job_id) find the record; written again at the end to outlive it
+                    shared_store.set(f"job-key:{self.id}", self.record_key, JOB_FINISHED_TTL)
+            except Exception as e:
+                print(f"Error publishing job {self.id}:", e)
+
+    def to_dict(self) -> dict:
+        return {
+            "jobId": self.id,
+            "kind": self.kind,
+            "machineId": self.key[0],
+            "projectName": self.key[1],
+            "status": self.status,
+            "progress": {"stage": self.stage, "done": self.done, "total": self.total},
+            "result": self.result,
+            "error": self.error,
+            "supersededBy": self.superseded_by,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+        }
+
+class JobQueue:
+    """
+    Bounded pool of worker threads running at most one job per key at a time (per project,
+    so deletes and adds of two uploads never interleave). Each key holds at most one
+    pending job: submitting another merges the two via `merge(older, newer)` when given,
+    otherwise the newer job replaces the older one. Across workers, a job runs only while
+    holding its key's lease in the shared store.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = max(1, workers)
+        self._jobs = OrderedDict()      # job id -> Job, oldest first
+        self._pending = {}              # key -> queued Job
+        self._running = set()           # keys with a job in flight
+        self._ready = deque()           # keys with a pending job and nothing running
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+
+    def submit(self, key: tuple, kind: str, payload, run, merge=None) -> Job:
+        with self._cond:
+            self._start_workers()
+            job = Job(key, kind, payload, run)
+            older = self._pending.get(key)
+            if older is not None:
+                if merge is not None:
+                    job.payload = merge(older.payload, payload)
+                self._finish(older, SUPERSEDED)
+                older.superseded_by = job.id
+            elif key not in self._running:
+                self._ready.append(key)
+            self._pending[key] = job
+            self._jobs[job.id] = job
+            self._prune()
+            self._cond.notify()
+        if older is not None:
+            older.publish()
+        job.publish()
+        return job
+
+    def get(self, job_id: str):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def jobs_for(self, key: tuple) -> list:
+        with self._cond:
+            return [job for job in self._jobs.values() if job.key == key]
+
+    def status(self, job_id: str):
+        """A job as a dict, from this worker or as last published by the worker running it."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        record_key = shared_store.get(f"job-key:{job_id}")
+        record = shared_store.get(record_key) if record_key else None
+        return json.loads(record) if record else None
+
+    def statuses_for(self, key: tuple) -> list:
+        statuses = {job.id: job.to_dict() for job in self.jobs_for(key)}
+        for _, record in shared_store.scan(job_prefix(key)):
+            status = json.loads(record)
+            # The prefix of project "a" also matches project "a:b"
+            if (status["machineId"], status["projectName"]) == tuple(key):
+                statuses.setdefault(status["jobId"], status)
+        return sorted(statuses.values(), key=lambda s: s["createdAt"])
+
+    def request_cancel(self, job_id: str):
+        """cancel(), extended to jobs owned by other workers; returns the job's status dict."""
+        job = self.cancel(job_id)
+        if job is not None:
+            return job.to_dict()
+        status = self.status(job_id)
+        if status is None or status["status"] in FINISHED:
+            return status
+        shared_store.set(f"job-cancel:{job_id}", "1", JOB_FINISHED_TTL)
+        return {**status, "cancelRequested": True}
+
+    def cancel(self, job_id: str):
+        """Cancel a queued job outright; a running one stops at its next check_cancelled()."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return job
+            job._cancel.set()
+            cancelled = job.status == QUEUED
+            if cancelled:
+                self._pending.pop(job.key, None)
+                if job.key in self._ready:
+                    self._ready.remove(job.key)
+                self._finish(job, CANCELLED)
+        if cancelled:
+            job.publish()
+        return job
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._stopped = True
+            cancelled = list(self._pending.values())
+            for job in cancelled:
+                job._cancel.set()
+                self._finish(job, CANCELLED)
+            self._pending.clear()
+            self._ready.clear()
+            for job in self._jobs.values():
+                if job.status == RUNNING:
+                    job._cancel.set()
+            self._cond.notify_all()
+        for job in cancelled:
+            job.publish()
+
+    def _start_workers(self) -> None:
+        # Lazily, so importing the module doesn't spawn threads
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"jobs-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                key = self._ready.popleft()
+                job = self._pending.pop(key)
+                self._running.add(key)
+                job.status = RUNNING
+                job.started_at = time.time()
+
+            try:
+                self._wait_for_lease(job)
+                try:
+                    job.stage = "running"
+                    job.publish()
+                    result, status, error = job.run(job), SUCCEEDED, None
+                finally:
+                    job.release_lease()
+            except JobCancelled:
+                result, status, error = None, CANCELLED, None
+            except Exception as e:
+                print(f"Error in job {job.kind} {job.id}:", e)
+                result, status, error = None, FAILED, str(e)
+
+            with self._cond:
+                job.result = result
+                job.error = error
+                self._finish(job, status)
+                self._running.discard(key)
+                if key in self._pending:
+                    self._ready.append(key)
+                    self._cond.notify()
+            job.publish()
+
+    def _wait_for_lease(self, job: Job) -> None:
+        """Block until no other worker runs a job for this key (two uploads must not interleave)."""
+        if job.acquire_lease():
+            return
+        job.stage = "waiting"
+        job.publish()
+        while not job.acquire_lease():
+            job.check_cancelled()
+            time.sleep(JOB_LEASE_POLL)
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.stage = status
+        job.finished_at = time.time()
+        job.payload = None      # uploads can be large; only status is kept around; callers publish
+
+    def _prune(self) -> None:
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.status in FINISHED]
+        excess = len(finished) - JOB_MAX_FINISHED
+        for job in finished:
+            if excess > 0 or now - job.finished_at > JOB_FINISHED_TTL:
+                del self._jobs[job.id]
+                excess -= 1
+
+job_queue = JobQueue()
@@ -0,0 +1,205 @@
+import os
+import re
+import sqlite3
+import threading
+
+from chroma_registry import CHROMA_ROOT
+
+SQLITE_MAX_PARAMS = 500
+RRF_K = 60
+
+WORD_RE = re.compile(r"\w+")
+# `iter_chunks`, `BasicToolNode`, `tools.get_weather`: answered from the index alone
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*")
+CAMEL_RE = re.compile(r"[a-z0-9][A-Z]|[A-Z]{2,}[a-z]")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    chunk_id TEXT NOT NULL,
+    project TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    line_start INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    UNIQUE (project, chunk_id)
+);
+CREATE INDEX IF NOT EXISTS chunks_project_path ON chunks (project, file_path);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    content, content='chunks', content_rowid='id', tokenize="unicode61 tokenchars '_'"
+);
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts (chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+def is_identifier_query(query: str) -> bool:
+    query = query.strip()
+    if not IDENTIFIER_RE.fullmatch(query):
+        return False
+    return "_" in query or "." in query or bool(CAMEL_RE.search(query))
+
+def _match_expression(query: str, exact: bool) -> str:
+    words = WORD_RE.findall(query)
+    if not words:
+        return ""
+    if exact:
+        return '"' + " ".join(words) + '"'
+    return " OR ".join(f'"{w}"' for w in words)
+
+class LexicalIndex:
+    """BM25 inverted index (SQLite FTS5) over a machine's chunks, one file next to its Chroma store."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def add(self, project: str, ids: list, documents: list, metadatas: list) -> None:
+        with self._lock:
+            conn = self._connection()
+            # Same chunk_id means same path and text, so only the position can change
+            conn.executemany(
+                "INSERT INTO chunks (chunk_id, project, file_path, line_start, content) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (project, chunk_id) DO UPDATE SET line_start = excluded.line_start",
+                [(i, project, m["file_path"], m["line_start"], d) for i, d, m in zip(ids, documents, metadatas)],
+            )
+            conn.commit()
+
+    def update_metadata(self, project: str, ids: list, metadatas: list) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "UPDATE chunks SET file_path = ?, line_start = ? WHERE chunk_id = ? AND project = ?",
+                [(m["file_path"], m["line_start"], i, project) for i, m in zip(ids, metadatas)],
+            )
+            conn.commit()
+
+    def apply(self, project: str, delete_ids: list, update_ids: list, update_metadatas: list,
+              add_ids: list, add_documents: list, add_metadatas: list) -> None:
+        """Deletes, position updates and inserts for one sync as a single transaction."""
+        with self._lock:
+            conn = self._connection()
+            try:
+                for i in range(0, len(delete_ids), SQLITE_MAX_PARAMS):
+                    batch = delete_ids[i:i + SQLITE_MAX_PARAMS]
+                    conn.execute(
+                        f"DELETE FROM chunks WHERE project = ? AND chunk_id IN ({','.join('?' * len(batch))})",
+                        [project, *batch],
+                    )
+                conn.executemany(
+                    "UPDATE chunks SET file_path = ?, line_start = ? WHERE chunk_id = ? AND project = ?",
+                    [(m["file_path"], m["line_start"], i, project) for i, m in zip(update_ids, update_metadatas)],
+                )
+                conn.executemany(
+                    "INSERT INTO chunks (chunk_id, project, file_path, line_start, content) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (project, chunk_id) DO UPDATE SET line_start = excluded.line_start",
+                    [(i, project, m["file_path"], m["line_start"], d)
+                     for i, d, m in zip(add_ids, add_documents, add_metadatas)],
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def delete_ids(self, project: str, ids: list) -> None:
+        self._delete_in(project, "chunk_id", ids)
+
+    def delete_paths(self, project: str, paths: list) -> None:
+        self._delete_in(project, "file_path", paths)
+
+    def _delete_in(self, project: str, column: str, values: list) -> None:
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(values), SQLITE_MAX_PARAMS):
+                batch = values[i:i + SQLITE_MAX_PARAMS]
+                conn.execute(
+                    f"DELETE FROM chunks WHERE project = ? AND {column} IN ({','.join('?' * len(batch))})",
+                    [project, *batch],
+                )
+            conn.commit()
+
+    def reset(self, project: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM chunks WHERE project = ?", (project,))
+            conn.commit()
+
+    def search(self, project: str, query: str, k: int, exact: bool = False) -> list:
+        """Top-k chunks by BM25 as dicts with id, file_path, line_start, document and score (higher is better)."""
+        expression = _match_expression(query, exact)
+        if not expression:
+            return []
+        with self._lock:
+            try:
+                rows = self._connection().execute(
+                    "SELECT c.chunk_id, c.file_path, c.line_start, c.content, bm25(chunks_fts) AS rank"
+                    " FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid"
+                    " WHERE chunks_fts MATCH ? AND c.project = ?"
+                    " ORDER BY rank LIMIT ?",
+                    (expression, project, k),
+                ).fetchall()
+            except sqlite3.OperationalError as e:
+                print("Error in lexical search:", e)
+                return []
+        # FTS5's bm25() is negative, more negative = better
+        return [
+            {"id": r[0], "file_path": r[1], "line_start": r[2], "document": r[3], "score": -r[4]}
+            for r in rows
+        ]
+
+class ProjectLexicalIndex:
+    """A LexicalIndex bound to one project, mirroring the project's Chroma collection."""
+
+    def __init__(self, index: LexicalIndex, project: str):
+        self.index = index
+        self.project = project
+
+    def add(self, ids, documents, metadatas):
+        self.index.add(self.project, ids, documents, metadatas)
+
+    def update_metadata(self, ids, metadatas):
+        self.index.update_metadata(self.project, ids, metadatas)
+
+    def apply(self, delete_ids, update_ids, update_metadatas, add_ids, add_documents, add_metadatas):
+        self.index.apply(self.project, delete_ids, update_ids, update_metadatas,
+                         add_ids, add_documents, add_metadatas)
+
+    def delete_ids(self, ids):
+        self.index.delete_ids(self.project, ids)
+
+    def delete_paths(self, paths):
+        self.index.delete_paths(self.project, paths)
+
+    def reset(self):
+        self.index.reset(self.project)
+
+    def search(self, query: str, k: int, exact: bool = False):
+        return self.index.search(self.project, query, k, exact)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def lexical_index(machine_id: str, project_name: str) -> ProjectLexicalIndex:
+    with _indexes_lock:
+        if machine_id not in _indexes:
+            _indexes[machine_id] = LexicalIndex(f"{CHROMA_ROOT}/{machine_id}/lexical.sqlite3")
+        return ProjectLexicalIndex(_indexes[machine_id], project_name)
+
+def reciprocal_rank_fusion(*rankings: list) -> list:
+    """Fuse ranked lists of IDs; each list contributes 1 / (RRF_K + rank) per ID."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
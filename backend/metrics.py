@@ -0,0 +1,261 @@
+import os
+import sys
+import time
+import uuid
+import asyncio
+import threading
+import contextvars
+from collections import Counter as Tally
+from contextlib import contextmanager
+
+TRACE_IDS_ENABLED   = os.getenv("TRACE_IDS_ENABLED", "1").lower() in ("1", "true", "yes")
+TRACE_SLOW_SECONDS  = float(os.getenv("TRACE_SLOW_SECONDS", "5"))     # log a stage breakdown above this
+LOOP_LAG_INTERVAL   = 0.5
+# The profiler exposes stack frames and adds overhead: off unless asked for, optionally behind a token
+PROFILER_ENABLED    = os.getenv("ENABLE_PROFILER", "").lower() in ("1", "true", "yes")
+PROFILER_TOKEN      = os.getenv("PROFILER_TOKEN")
+WEB_CONCURRENCY     = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# ---------- Metric types ----------
+_registry = []
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    parts = [n + '="' + _escape(v) + '"' for n, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Histogram:
+    """Prometheus-style cumulative histogram with labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}       # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(elapsed, **labels)
+            record_stage(self.name, elapsed, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                bounds = [str(b) for b in self.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, series[:-2] + [series[-1]]):
+                    labels = _label_text(self.labelnames, key, 'le="' + bound + '"')
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _label_text(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+def worker_scope() -> dict:
+    """Which process a metrics or profiler response describes; each worker keeps its own."""
+    return {"pid": os.getpid(), "workers": WEB_CONCURRENCY,
+            "scope": "this worker process only" if WEB_CONCURRENCY > 1 else "the whole server"}
+
+def render_metrics() -> str:
+    scope = worker_scope()
+    header = [f"# Scraper.AI metrics for {scope['scope']} (pid {scope['pid']}, {scope['workers']} worker(s))"]
+    return "\n".join(header + [line for metric in _registry for line in metric.render()]) + "\n"
+
+# ---------- Backend metrics ----------
+HTTP_SECONDS = Histogram("http_request_seconds", "HTTP requests served, by route and status.", ("method", "route", "status"))
+LLM_SECONDS = Histogram("llm_request_seconds", "Chat model calls from chatbot_node.", ("model", "status"))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens sent to and received from the chat model.", ("model", "kind"))
+TOOL_SECONDS = Histogram("tool_call_seconds", "Tool invocations in BasicToolNode, including queueing.", ("tool", "status"))
+UPSTREAM_SECONDS = Histogram("upstream_request_seconds", "Outbound HTTP requests (GitHub, Brave, ...), per attempt.",
+                             ("host", "status"))
+CHUNKING_SECONDS = Histogram("chunking_seconds", "Time to chunk one file.",
+                             buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+EMBEDDING_SECONDS = Histogram("embedding_batch_seconds", "Embedding API requests, per batch.", ("status",))
+EMBEDDING_INPUTS = Counter("embedding_inputs_total", "Texts embedded via the API (cache misses).")
+CHROMA_SECONDS = Histogram("chroma_operation_seconds", "Chroma collection operations.", ("op",))
+LOOP_LAG_SECONDS = Histogram("event_loop_lag_seconds", "How late the event loop runs a timer; high = blocked loop.",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+# ---------- Trace IDs ----------
+trace_id = contextvars.ContextVar("trace_id", default=None)
+_trace_stages = contextvars.ContextVar("trace_stages", default=None)
+_stages_lock = threading.Lock()
+
+def record_stage(name: str, seconds: float, **labels) -> None:
+    """Add time to the current request's breakdown (no-op outside a traced request)."""
+    stages = _trace_stages.get()
+    if stages is None:
+        return
+    key = name + "".join(f":{v}" for k, v in labels.items() if k not in ("status",))
+    with _stages_lock:
+        stages[key] = stages.get(key, 0.0) + seconds
+
+class TraceMiddleware:
+    """
+    ASGI middleware: per-request trace ID (from X-Trace-Id or fresh) returned as a header,
+    request timing by route, and a stage breakdown logged for slow requests.
+    Plain ASGI rather than BaseHTTPMiddleware so streaming and disconnect detection are untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        incoming = dict(scope.get("headers") or []).get(b"x-trace-id")
+        current = incoming.decode("latin-1")[:64] if incoming else uuid.uuid4().hex[:16]
+        trace_token = trace_id.set(current)
+        stages_token = _trace_stages.set({})
+        status = {"code": 500}
+        start = time.perf_counter()
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if TRACE_IDS_ENABLED:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-trace-id", current.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = getattr(scope.get("route"), "path", None) or getattr(scope.get("endpoint"), "__name__", "unmatched")
+            HTTP_SECONDS.observe(elapsed, method=scope["method"], route=route, status=status["code"])
+            stages = _trace_stages.get()
+            if elapsed >= TRACE_SLOW_SECONDS and stages:
+                breakdown = ", ".join(f"{k}={v:.3f}s" for k, v in sorted(stages.items(), key=lambda s: -s[1]))
+                print(f"[trace {current}] {scope['method']} {scope['path']} took {elapsed:.3f}s: {breakdown}")
+            trace_id.reset(trace_token)
+            _trace_stages.reset(stages_token)
+
+# ---------- Event loop lag ----------
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """Runs forever on the event loop; anything blocking the loop shows up as lag."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
+
+# ---------- Sampling profiler ----------
+class SamplingProfiler:
+    """
+    Samples every thread's stack on an interval and counts collapsed stacks
+    (flamegraph.pl / speedscope "folded" format). Cheap enough to switch on in production briefly.
+    """
+
+    def __init__(self):
+        self.interval = 0.01
+        self.samples = Tally()
+        self.started_at = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._samples_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.01) -> None:
+        with self._lock:
+            if self.running:
+                return
+            self.interval = max(0.001, interval)
+            with self._samples_lock:
+                self.samples = Tally()
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> dict:
+        with self._lock:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join(timeout=5)
+            self._thread = None
+            return self.report()
+
+    def report(self, limit: int = 500) -> dict:
+        with self._samples_lock:
+            samples = Tally(self.samples)
+        return {
+            "worker": worker_scope(),
+            "running": self.running,
+            "interval_s": self.interval,
+            "started_at": self.started_at,
+            "total_samples": sum(samples.values()),
+            "folded": [f"{stack} {count}" for stack, count in samples.most_common(limit)],
+        }
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()} if len(names) != threading.active_count() else names
+            batch = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                batch.append(names.get(ident, "thread") + ";" + ";".join(reversed(stack)))
+            with self._samples_lock:
+                self.samples.update(batch)
+
+profiler = SamplingProfiler()
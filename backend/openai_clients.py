@@ -0,0 +1,76 @@
+import os
+import threading
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+# Imported ahead of the modules that call load_dotenv themselves (embeddings reads the key at import)
+load_dotenv()
+
+OPENAI_API_KEY         = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL        = os.getenv("OPENAI_BASE_URL") or None     # e.g. a local fake server for benchmarks
+CHAT_MODEL             = os.getenv("CHAT_MODEL", "gpt-4o")
+VISION_MODEL           = os.getenv("VISION_MODEL", CHAT_MODEL)     # must accept image inputs
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))
+OPENAI_MAX_KEEPALIVE   = int(os.getenv("OPENAI_MAX_KEEPALIVE", "32"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT    = float(os.getenv("OPENAI_READ_TIMEOUT", "120"))   # long completions stream for a while
+
+TIMEOUT = httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+LIMITS = httpx.Limits(
+    max_connections=OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+    keepalive_expiry=60,
+)
+
+_lock = threading.Lock()
+_http = None
+_async_http = None
+_client = None
+_async_client = None
+
+# ---------- Connection pools ----------
+# One pool per flavour for every OpenAI caller (chat model, tools, embeddings), so TLS
+# connections to the API are set up once and kept alive between requests
+def get_http_client() -> httpx.Client:
+    global _http
+    with _lock:
+        if _http is None:
+            _http = httpx.Client(timeout=TIMEOUT, limits=LIMITS)
+        return _http
+
+def get_async_http_client() -> httpx.AsyncClient:
+    global _async_http
+    with _lock:
+        if _async_http is None:
+            _async_http = httpx.AsyncClient(timeout=TIMEOUT, limits=LIMITS)
+        return _async_http
+
+# ---------- SDK clients ----------
+def get_openai_client() -> openai.OpenAI:
+    """Shared blocking client, for code running on worker threads (tools, embeddings)."""
+    global _client
+    http = get_http_client()
+    with _lock:
+        if _client is None:
+            _client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http)
+        return _client
+
+def get_async_openai_client() -> openai.AsyncOpenAI:
+    global _async_client
+    http = get_async_http_client()
+    with _lock:
+        if _async_client is None:
+            _async_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http)
+        return _async_client
+
+async def close_openai_clients() -> None:
+    global _http, _async_http, _client, _async_client
+    _client = _async_client = None
+    if _http is not None:
+        _http.close()
+        _http = None
+    if _async_http is not None:
+        await _async_http.aclose()
+        _async_http = None
@@ -0,0 +1,118 @@
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+from embeddings import embed_query, normalize_query
+from tool_cache import LRUCache
+from shared_store import shared_store
+
+REPLY_CACHE_TTL        = float(os.getenv("REPLY_CACHE_TTL", str(6 * 60 * 60)))
+REPLY_CACHE_ENTRIES    = int(os.getenv("REPLY_CACHE_ENTRIES", "2048"))
+REPLY_CACHE_MAX_BYTES  = int(os.getenv("REPLY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Cosine similarity a prompt needs to reuse the reply to a different prompt in the same context;
+# 0 turns the similarity tier off (the default: near-duplicates aren't always the same question)
+REPLY_CACHE_SIMILARITY = float(os.getenv("REPLY_CACHE_SIMILARITY", "0"))
+REPLY_CACHE_NEIGHBOURS = 32          # prompts remembered per context for the similarity tier
+REPLY_CACHE_DISABLED   = os.getenv("REPLY_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+# A reply that used one of these tools depends on when it was asked, not just on what
+UNCACHEABLE_TOOLS = {"get_weather", "get_current_date", "brave_search"}
+
+def digest(value) -> str:
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    elif not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(value).hexdigest()
+
+def history_fingerprint(messages: list) -> str:
+    """Hash of a thread's history: a reply is only reusable after the same conversation."""
+    return digest([
+        (m.type, m.content, [(c["name"], c["args"]) for c in getattr(m, "tool_calls", None) or []])
+        for m in messages
+    ])
+
+class ReplyCache:
+    """
+    /chat replies keyed by everything that shapes them: the prompt and, as the "context",
+    selection, file, image, model, system prompt, thread history and project index generation.
+    Exact matches come from an LRU backed by the shared store (so every worker sees them);
+    optionally, a prompt close enough (by embedding) to one already answered in the same
+    context reuses that answer.
+    """
+
+    def __init__(self, max_entries: int = REPLY_CACHE_ENTRIES, max_bytes: int = REPLY_CACHE_MAX_BYTES,
+                 ttl: float = REPLY_CACHE_TTL, similarity: float = REPLY_CACHE_SIMILARITY):
+        self.ttl = ttl
+        self.similarity = similarity
+        self._exact = LRUCache(max_entries, max_bytes)         # key -> reply
+        self._neighbours = LRUCache(max_entries, max_bytes)    # context -> [(unit vector, reply)]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def context_key(**parts) -> str:
+        return digest(parts)
+
+    @staticmethod
+    def key(context: str, prompt: str) -> str:
+        return digest([context, normalize_query(prompt)])
+
+    def _vector(self, prompt: str):
+        vector = np.asarray(embed_query(prompt), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, context: str, prompt: str):
+        """Cached reply or None. Blocking when the similarity tier has to embed the prompt."""
+        key = self.key(context, prompt)
+        reply = self._exact.get(key)
+        if reply is None:
+            reply = shared_store.get(f"reply:{key}")
+            if reply is not None:
+                self._exact.set(key, reply, self.ttl, len(reply.encode("utf-8")))
+        if reply is not None:
+            with self._lock:
+                self.hits += 1
+            return reply
+        if self.similarity > 0 and prompt.strip():
+            neighbours = self._neighbours.get(context)
+            if neighbours:
+                vector = self._vector(prompt)
+                best = max(neighbours, key=lambda n: float(np.dot(n[0], vector)))
+                if float(np.dot(best[0], vector)) >= self.similarity:
+                    with self._lock:
+                        self.similar_hits += 1
+                    return best[1]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, context: str, prompt: str, reply: str) -> None:
+        key = self.key(context, prompt)
+        self._exact.set(key, reply, self.ttl, len(reply.encode("utf-8")))
+        shared_store.set(f"reply:{key}", reply, self.ttl)
+        if self.similarity > 0 and prompt.strip():
+            vector = self._vector(prompt)
+            with self._lock:
+                neighbours = list(self._neighbours.get(context) or [])
+                neighbours.append((vector, reply))
+                neighbours = neighbours[-REPLY_CACHE_NEIGHBOURS:]
+                self._neighbours.set(context, neighbours, self.ttl,
+                                     sum(v.nbytes + len(r.encode("utf-8")) for v, r in neighbours))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "entries": len(self._exact._entries),
+                "bytes": self._exact.total_bytes,
+            }
+
+reply_cache = ReplyCache()
@@ -1,16 +1,37 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import fnmatch
+import hashlib
+import json
 import os
+import time
 import uuid
-from tqdm import tqdm
-from chromadb import PersistentClient
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import numpy as np
+from embeddings import embed_texts, embed_queries, normalize_query
+from tool_cache import LRUCache
+from chroma_registry import registry
+from jobs import job_queue
+from lexical_index import lexical_index, is_identifier_query, reciprocal_rank_fusion
+from chunking import iter_chunks, count_tokens
+from metrics import CHUNKING_SECONDS
 
 router = APIRouter()
 
-BATCH_SIZE = 100
+BATCH_SIZE = 1000                        # chunks per collection write; embeddings.py splits them into token-sized requests
+SYNC_PATHS_PER_QUERY = 500               # paths per `$in` filter when reading or deleting by path
+STREAM_QUEUE_FRAMES = 8                  # file frames buffered between the network reader and the indexer
+UPLOAD_SESSION_TTL = 60 * 60             # seconds an interrupted streaming upload can be resumed
+SEARCH_TOP_K = 3
+SEARCH_MAX_TOP_K = 50
+CHAT_CONTEXT_TOP_K = int(os.getenv("CHAT_CONTEXT_TOP_K", "10"))   # candidates retrieve_context fits into its token budget
+SEARCH_CANDIDATES = 20                   # per-retriever candidates fed into rank fusion
+SNIPPET_CHARS = 800
+SEARCH_CACHE_ENTRIES = 4096
+SEARCH_CACHE_TTL = 60 * 60
 
 # ---------- Models ----------
 class FileData(BaseModel):
@@ -27,178 +48,784 @@ class UploadFolderRequest(BaseModel):
 class SemanticSearchRequest(BaseModel):
     machineId: str
     projectName: str
-    query: str
+    query: Optional[str] = None
+    queries: Optional[List[str]] = None      # batch form: all queries share one embedding call
+    top_k: Optional[int] = SEARCH_TOP_K
+    min_score: Optional[float] = None        # cosine similarity in [0, 1]
+    include: Optional[List[str]] = None      # path globs, e.g. ["src/**", "*.py"]
+    exclude: Optional[List[str]] = None
 
 class DeleteProjectRequest(BaseModel):
     machineId: str
     projectName: str
 
-# ---------- Embedding Setup ----------
-embedding_function = OpenAIEmbeddingFunction(api_key=os.environ["OPENAI_API_KEY"])
-
-# ---------- Classic 500/150 splitter in 20-line windows ----------
-SPLITTER = RecursiveCharacterTextSplitter(
-    chunk_size=500,
-    chunk_overlap=150,
-)
-
-def classic_500_chunks(content: str):
-    content = content or ""
-    lines = content.splitlines()
-    for i in range(0, len(lines), 20):
-        block = "\n".join(lines[i:i + 20])
-        docs = SPLITTER.split_text(block)
-        for doc in docs:
-            yield doc, (i + 1)
-
-# ---------- Upload Folder (full or incremental) ----------
-@router.post("/upload-folder")
-async def upload_folder(payload: UploadFolderRequest):
+# ---------- Chunk metadata ----------
+def path_metadata(file_path: str) -> dict:
+    """Metadata that lets simple path globs be pushed down to Chroma as `where` filters."""
+    path = file_path.replace("\\", "/")
+    name = path.rsplit("/", 1)[-1]
+    return {
+        "ext": ("." + name.rsplit(".", 1)[1].lower()) if "." in name else "",
+        "top_dir": path.split("/", 1)[0] if "/" in path else "",
+    }
+
+# ---------- Deterministic chunk IDs ----------
+def chunk_id(file_path: str, content: str, occurrence: int = 0) -> str:
+    """Content-addressed ID, so an unchanged chunk keeps its ID (and embedding) across uploads."""
+    h = hashlib.sha256()
+    h.update(file_path.encode("utf-8"))
+    h.update(b"\0")
+    h.update(content.encode("utf-8"))
+    if occurrence:
+        # identical chunks inside one file still need distinct IDs
+        h.update(f"\0{occurrence}".encode("utf-8"))
+    return h.hexdigest()
+
+def file_chunks(file_path: str, content: str):
+    """Yield (id, document, metadata) for every chunk of a file."""
+    seen = {}
+    path_meta = path_metadata(file_path)
+    chunks = iter_chunks(file_path, content or "")
+    # Timed per next() so the consumer's work (embedding, writes) isn't counted as chunking
+    elapsed = 0.0
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        elapsed += time.perf_counter() - start
+        if chunk is None:
+            break
+        occurrence = seen.get(chunk.text, 0)
+        seen[chunk.text] = occurrence + 1
+        yield chunk_id(file_path, chunk.text, occurrence), chunk.text, {
+            "file_path":  file_path,
+            "line_start": chunk.line_start,
+            "line_end":   chunk.line_end,
+            "byte_start": chunk.byte_start,
+            "byte_end":   chunk.byte_end,
+            **path_meta,
+        }
+    CHUNKING_SECONDS.observe(elapsed)
+
+class ChunkWriter:
+    """
+    Buffers chunks across files and writes them in BATCH_SIZE batches, with embeddings
+    from the shared cache, so memory stays O(batch) no matter how much is being indexed.
+    `on_commit(path)` fires once every chunk of a finished file has been written.
+    When a lexical index is given it receives the same chunks, keeping hybrid search in sync.
+    Like sync_file and delete_files it doesn't bump the collection's generation; the caller
+    does that once when its whole write is done, so other workers reload once per upload.
+    """
+
+    def __init__(self, collection, lexical=None, on_commit=None):
+        self.collection = collection
+        self.lexical = lexical
+        self.on_commit = on_commit
+        self.ids, self.documents, self.metadatas = [], [], []
+        self.pending_paths = []
+        self.added = 0
+
+    def add(self, chunk_id_: str, document: str, metadata: dict) -> None:
+        self.ids.append(chunk_id_)
+        self.documents.append(document)
+        self.metadatas.append(metadata)
+        if len(self.ids) >= BATCH_SIZE:
+            self.flush()
+
+    def file_done(self, path: str) -> None:
+        self.pending_paths.append(path)
+        if not self.ids:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.ids:
+            self.collection.add(
+                documents=self.documents,
+                embeddings=embed_texts(self.documents),
+                metadatas=self.metadatas,
+                ids=self.ids
+            )
+            if self.lexical is not None:
+                self.lexical.add(self.ids, self.documents, self.metadatas)
+            self.added += len(self.ids)
+            self.ids, self.documents, self.metadatas = [], [], []
+        if self.on_commit:
+            for path in self.pending_paths:
+                self.on_commit(path)
+        self.pending_paths = []
+
+def sync_file(collection, writer: ChunkWriter, path: str, content: str):
+    """
+    Bring one file's chunks in the collection up to date: vanished chunks are deleted,
+    moved chunks get a metadata-only update and only new chunks are queued for embedding.
+    Returns (added, deleted, unchanged) chunk counts.
+    """
+    existing = collection.get(where={"file_path": path}, include=["metadatas"])
+    existing_meta = dict(zip(existing["ids"], existing["metadatas"]))
+
+    moved_ids, moved_metas = [], []
+    new_ids = set()
+    added = 0
+    for chunk_id_, ch, metadata in file_chunks(path, content):
+        new_ids.add(chunk_id_)
+        if chunk_id_ not in existing_meta:
+            writer.add(chunk_id_, ch, metadata)
+            added += 1
+        elif existing_meta[chunk_id_] != metadata:
+            # same text, shifted position: metadata-only update, no re-embedding
+            moved_ids.append(chunk_id_)
+            moved_metas.append(metadata)
+
+    stale = [i for i in existing_meta if i not in new_ids]
+    if stale:
+        collection.delete(ids=stale)
+    if moved_ids:
+        collection.update(ids=moved_ids, metadatas=moved_metas)
+    if writer.lexical is not None:
+        if stale:
+            writer.lexical.delete_ids(stale)
+        if moved_ids:
+            writer.lexical.update_metadata(moved_ids, moved_metas)
+    writer.file_done(path)
+    return added, len(stale), len(new_ids) - added
+
+def open_collection(machine_id: str, project_name: str, reset: bool = False):
+    """Get (or create) a project's collection; reset=True starts it (and its lexical index) from scratch."""
+    if reset:
+        lexical_index(machine_id, project_name).reset()
+        return registry.reset_collection(machine_id, project_name)
+    return registry.get_collection(machine_id, project_name, create=True)
+
+def _path_filter_batches(paths: list):
+    for i in range(0, len(paths), SYNC_PATHS_PER_QUERY):
+        yield {"file_path": {"$in": paths[i:i + SYNC_PATHS_PER_QUERY]}}
+
+def delete_files(collection, lexical, paths: list) -> None:
+    if not paths:
+        return
+    for where in _path_filter_batches(paths):
+        collection.delete(where=where)
+    lexical.delete_paths(paths)
+
+def sync_files(collection, lexical, files: list, deleted: list, job=None) -> dict:
+    """
+    Incremental sync of many files as one logical transaction: a single read of every
+    affected path's chunk ids, then every new chunk is embedded before anything is written,
+    so an embedding failure (or cancelling `job`) leaves the collection untouched. Then one
+    ID-set delete, one metadata update for moved chunks and BATCH_SIZE adds; if any write
+    fails, the collection is put back as it was.
+    """
+    paths = list(dict.fromkeys([f.path for f in files] + list(deleted)))
+    existing = {}       # chunk id -> metadata
+    for where in _path_filter_batches(paths):
+        got = collection.get(where=where, include=["metadatas"])
+        existing.update(zip(got["ids"], got["metadatas"]))
+
+    keep = set()
+    add_ids, add_documents, add_metadatas = [], [], []
+    moved_ids, moved_metas = [], []
+    for n, f in enumerate(files):
+        if job is not None:
+            job.check_cancelled()
+            job.report("chunking", n, len(files))
+        for chunk_id_, ch, metadata in file_chunks(f.path, f.content):
+            if chunk_id_ in keep:
+                continue
+            keep.add(chunk_id_)
+            if chunk_id_ not in existing:
+                add_ids.append(chunk_id_)
+                add_documents.append(ch)
+                add_metadatas.append(metadata)
+            elif existing[chunk_id_] != metadata:
+                # same text, shifted position: metadata-only update, no re-embedding
+                moved_ids.append(chunk_id_)
+                moved_metas.append(metadata)
+    stale = [cid for cid in existing if cid not in keep]
+
+    # Embedding fills the shared embedding cache; the writes below read the vectors back from it
+    # batch by batch, so nothing is held for the whole sync and the API is done before any write
+    for i in range(0, len(add_ids), BATCH_SIZE):
+        if job is not None:
+            job.check_cancelled()
+            job.report("embedding", i, len(add_ids))
+        embed_texts(add_documents[i:i + BATCH_SIZE])
+
+    # Only what a rollback would have to put back: the chunks about to be deleted
+    removed = {}        # chunk id -> (document, embedding)
+    for i in range(0, len(stale), BATCH_SIZE):
+        got = collection.get(ids=stale[i:i + BATCH_SIZE], include=["documents", "embeddings"])
+        removed.update((cid, (document, embedding)) for cid, document, embedding
+                       in zip(got["ids"], got["documents"], got["embeddings"]))
+
+    if job is not None:
+        job.report("writing", 0, len(add_ids))
+    added, deleted_ids, updated = [], [], False
     try:
-        machine_id   = payload.machineId
-        project_name = payload.projectName
-        files        = payload.files or []
-        deleted      = payload.deleted or []
-        incremental  = bool(payload.incremental)
-
-        user_path = f"./chroma_db/{machine_id}"
-        coll_name = f"{machine_id}-{project_name}"
-
-        client = PersistentClient(path=user_path)
-
-        if not incremental:
-            # -------- FULL REBUILD --------
-            try:
-                client.delete_collection(name=coll_name)
-            except Exception:
-                pass
-
-            collection = client.create_collection(
-                name=coll_name,
-                embedding_function=embedding_function
+        for i in range(0, len(stale), BATCH_SIZE):
+            batch = stale[i:i + BATCH_SIZE]
+            collection.delete(ids=batch)
+            deleted_ids.extend(batch)
+        if moved_ids:
+            updated = True
+            collection.update(ids=moved_ids, metadatas=moved_metas)
+        for i in range(0, len(add_ids), BATCH_SIZE):
+            batch = slice(i, i + BATCH_SIZE)
+            collection.add(
+                ids=add_ids[batch],
+                documents=add_documents[batch],
+                embeddings=embed_texts(add_documents[batch]),
+                metadatas=add_metadatas[batch],
+            )
+            added.extend(add_ids[batch])
+        lexical.apply(stale, moved_ids, moved_metas, add_ids, add_documents, add_metadatas)
+    except Exception:
+        _rollback_sync(collection, existing, removed, added, deleted_ids, moved_ids if updated else [])
+        raise
+    finally:
+        registry.bump(collection.name)
+
+    return {
+        "chunks_added": len(add_ids),
+        "chunks_deleted": len(stale),
+        "chunks_unchanged": len(keep) - len(add_ids),
+    }
+
+def _rollback_sync(collection, existing: dict, removed: dict, added: list, deleted_ids: list,
+                   moved_ids: list) -> None:
+    """Undo a partially applied sync_files(): drop what it added, restore what it removed or moved."""
+    try:
+        for i in range(0, len(added), BATCH_SIZE):
+            collection.delete(ids=added[i:i + BATCH_SIZE])
+        restore = [cid for cid in deleted_ids if cid in removed]
+        for i in range(0, len(restore), BATCH_SIZE):
+            batch = restore[i:i + BATCH_SIZE]
+            collection.add(
+                ids=batch,
+                metadatas=[existing[cid] for cid in batch],
+                documents=[removed[cid][0] for cid in batch],
+                embeddings=[removed[cid][1] for cid in batch],
             )
+        if moved_ids:
+            collection.update(ids=moved_ids, metadatas=[existing[cid] for cid in moved_ids])
+    except Exception as e:
+        print("Error rolling back sync:", e)
 
-            documents, metadatas, ids = [], [], []
+# ---------- Upload Folder (full or incremental) ----------
+def index_upload(job) -> dict:
+    """Run a queued /upload-folder job: full rebuild or incremental upsert of one project."""
+    job.report("waiting")
+    # Other workers may be writing to the same machineId store
+    with registry.write_lock(job.key[0]), registry.pinned(job.key[0]):
+        return _apply_upload(job)
+
+def _apply_upload(job) -> dict:
+    machine_id, project_name = job.key
+    files, deleted, incremental = job.payload["files"], job.payload["deleted"], job.payload["incremental"]
+
+    if not incremental:
+        # -------- FULL REBUILD --------
+        collection = open_collection(machine_id, project_name, reset=True)
+        writer = ChunkWriter(collection, lexical_index(machine_id, project_name))
 
-            for f in files:
-                for ch, line_start in classic_500_chunks(f.content):
-                    documents.append(ch)
-                    metadatas.append({
-                        "file_path":  f.path,
-                        "line_start": line_start,
-                    })
-                    ids.append(str(uuid.uuid4()))
+        try:
+            for n, f in enumerate(files):
+                # A cancelled rebuild keeps the files written so far; re-uploading finishes it
+                job.check_cancelled()
+                job.report("indexing", n, len(files))
+                for chunk_id_, ch, metadata in file_chunks(f.path, f.content):
+                    writer.add(chunk_id_, ch, metadata)
+            writer.flush()
+        finally:
+            registry.bump(collection.name)
+        job.report("indexing", len(files), len(files))
+
+        return {"status": "uploaded_full", "chunks": writer.added}
+
+    # -------- INCREMENTAL UPSERT --------
+    collection = open_collection(machine_id, project_name)
+    lexical = lexical_index(machine_id, project_name)
+
+    # Diff every affected path against the collection in one pass; only new chunks are embedded
+    totals = sync_files(collection, lexical, files, deleted, job)
+
+    return {
+        "status": "uploaded_incremental",
+        "changed_files": len(files),
+        "deleted_files": len(deleted),
+        **totals,
+    }
+
+def merge_uploads(older: dict, newer: dict) -> dict:
+    """
+    Fold a newer upload into one still waiting in the queue. A newer full upload replaces
+    everything; otherwise the newer file versions and deletions are layered on top.
+    """
+    if not newer["incremental"]:
+        return newer
+    files = {f.path: f for f in older["files"]}
+    for path in newer["deleted"]:
+        files.pop(path, None)
+    files.update({f.path: f for f in newer["files"]})
+    deleted = [p for p in dict.fromkeys(older["deleted"] + newer["deleted"]) if p not in files]
+    # A full rebuild stays a full rebuild (its deletions are implicit)
+    return {"files": list(files.values()), "deleted": deleted if older["incremental"] else [],
+            "incremental": older["incremental"]}
 
-            for i in tqdm(range(0, len(documents), BATCH_SIZE)):
-                collection.add(
-                    documents=documents[i:i + BATCH_SIZE],
-                    metadatas=metadatas[i:i + BATCH_SIZE],
-                    ids=ids[i:i + BATCH_SIZE]
-                )
+@router.post("/upload-folder")
+def upload_folder(payload: UploadFolderRequest):
+    """Queue an upload and return its job ID at once; poll /jobs/{jobId} for progress and the result."""
+    try:
+        job = job_queue.submit(
+            (payload.machineId, payload.projectName),
+            "upload",
+            {"files": payload.files or [], "deleted": payload.deleted or [], "incremental": bool(payload.incremental)},
+            index_upload,
+            merge=merge_uploads,
+        )
+        return {"status": "queued", "jobId": job.id}
 
-            return {"status": "uploaded_full", "chunks": len(documents)}
+    except Exception as e:
+        print("Error in upload_folder:", e)
+        return {"error": str(e)}
 
-        # -------- INCREMENTAL UPSERT --------
-        # Ensure collection exists
+# ---------- Jobs ----------
+@router.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    status = job_queue.status(job_id)
+    if status is None:
+        return {"error": "Unknown or expired job."}
+    return status
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    status = job_queue.request_cancel(job_id)
+    if status is None:
+        return {"error": "Unknown or expired job."}
+    return status
+
+@router.get("/jobs")
+def project_jobs(machineId: str, projectName: str):
+    return {"jobs": job_queue.statuses_for((machineId, projectName))}
+
+# ---------- Streaming Upload (NDJSON) ----------
+class UploadSession:
+    """State of a streaming upload, kept so an interrupted upload can resume where it stopped."""
+
+    def __init__(self, session_id: str, machine_id: str, project_name: str, incremental: bool):
+        self.session_id = session_id
+        self.machine_id = machine_id
+        self.project_name = project_name
+        self.incremental = incremental
+        self.committed = set()           # paths fully written (or deleted) by this session
+        self.touched = time.time()
+        self.lock = asyncio.Lock()
+
+upload_sessions = {}
+
+@asynccontextmanager
+async def store_writer(machine_id: str):
+    """
+    registry.write_lock plus registry.pinned for async handlers; both are entered on a
+    worker thread, since they can wait on another writer or open the store.
+    """
+    lock = registry.write_lock(machine_id)
+    pin = registry.pinned(machine_id)
+    await run_in_threadpool(lock.acquire)
+    try:
+        await run_in_threadpool(pin.__enter__)
         try:
-            collection = client.get_collection(coll_name, embedding_function=embedding_function)
-        except Exception:
-            collection = client.create_collection(coll_name, embedding_function=embedding_function)
-
-        # 1) Delete removed files entirely
-        for rel_path in deleted:
-            collection.delete(where={"file_path": rel_path})
-
-        # 2) For each changed/new file: delete old chunks for that path, then add new chunks
-        total_added = 0
-        for f in files:
-            # remove old chunks for this file
-            collection.delete(where={"file_path": f.path})
-
-            documents, metadatas, ids = [], [], []
-            for ch, line_start in classic_500_chunks(f.content):
-                documents.append(ch)
-                metadatas.append({
-                    "file_path":  f.path,
-                    "line_start": line_start,
-                })
-                ids.append(str(uuid.uuid4()))
-
-            for i in range(0, len(documents), BATCH_SIZE):
-                collection.add(
-                    documents=documents[i:i + BATCH_SIZE],
-                    metadatas=metadatas[i:i + BATCH_SIZE],
-                    ids=ids[i:i + BATCH_SIZE]
-                )
-            total_added += len(documents)
-
+            yield
+        finally:
+            pin.__exit__(None, None, None)
+    finally:
+        lock.release()
+
+def _expire_upload_sessions() -> None:
+    now = time.time()
+    for session_id in [sid for sid, s in upload_sessions.items() if now - s.touched > UPLOAD_SESSION_TTL]:
+        del upload_sessions[session_id]
+
+async def _ndjson_frames(request: Request):
+    """Yield JSON frames from an NDJSON request body as the bytes arrive."""
+    buffer = bytearray()
+    async for piece in request.stream():
+        buffer.extend(piece)
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            line = bytes(buffer[start:end]).strip()
+            start = end + 1
+            if line:
+                yield json.loads(line)
+        del buffer[:start]
+    if bytes(buffer).strip():
+        yield json.loads(bytes(buffer))
+
+@router.post("/upload-stream")
+async def upload_stream(request: Request):
+    """
+    Streaming counterpart of /upload-folder. The body is NDJSON, one frame per line:
+      {"type": "start", "machineId": ..., "projectName": ..., "incremental": false, "sessionId": optional}
+      {"type": "file", "path": ..., "content": ...}
+      {"type": "delete", "path": ...}
+      {"type": "end"}
+    Files are chunked, embedded and written while the rest of the body is still arriving.
+    Passing back the sessionId of an interrupted upload skips files it already committed.
+    Sessions live in the memory of the worker that started them: with several workers a
+    resume must be routed to the same one (sticky sessions), otherwise it is refused.
+    """
+    frames = _ndjson_frames(request)
+    try:
+        start = await frames.__anext__()
+        if start.get("type") != "start" or not start.get("machineId") or not start.get("projectName"):
+            return {"error": "First frame must be a start frame with machineId and projectName."}
+
+        _expire_upload_sessions()
+        session = upload_sessions.get(start.get("sessionId") or "")
+        resumed = session is not None
+        if start.get("sessionId") and not resumed:
+            # Starting over silently would drop the files the client now skips as committed
+            return {"error": "Unknown or expired upload session. Resume on the worker that started it, "
+                             "or start a new upload without a sessionId."}
+        if not resumed:
+            session = UploadSession(str(uuid.uuid4()), start["machineId"], start["projectName"],
+                                    bool(start.get("incremental")))
+            upload_sessions[session.session_id] = session
+        elif (session.machine_id, session.project_name) != (start["machineId"], start["projectName"]):
+            return {"error": "Session belongs to a different project."}
+
+        if session.lock.locked():
+            return {"error": "This upload session is already in progress."}
+
+        async with session.lock, store_writer(session.machine_id):
+            # Only a brand-new full upload wipes the collection; a resumed one keeps what it already wrote
+            reset = not session.incremental and not resumed
+            collection = await run_in_threadpool(open_collection, session.machine_id, session.project_name, reset)
+            lexical = lexical_index(session.machine_id, session.project_name)
+            writer = ChunkWriter(collection, lexical, on_commit=session.committed.add)
+            totals = {"files": 0, "skipped_files": 0, "deleted_files": 0,
+                      "chunks_deleted": 0, "chunks_unchanged": 0}
+
+            def process(frame: dict) -> None:
+                path = frame.get("path")
+                if frame["type"] == "file":
+                    if path in session.committed:
+                        totals["skipped_files"] += 1
+                        return
+                    _, removed, unchanged = sync_file(collection, writer, path, frame.get("content") or "")
+                    totals["files"] += 1
+                    totals["chunks_deleted"] += removed
+                    totals["chunks_unchanged"] += unchanged
+                elif frame["type"] == "delete":
+                    delete_files(collection, lexical, [path])
+                    session.committed.add(path)
+                    totals["deleted_files"] += 1
+
+            # Bounded queue: the reader stalls (and TCP backpressure kicks in) when indexing falls behind
+            queue = asyncio.Queue(maxsize=STREAM_QUEUE_FRAMES)
+
+            failure = []
+
+            async def index_frames():
+                # Keeps draining after a failure so the reader never blocks on a full queue
+                while True:
+                    frame = await queue.get()
+                    if frame is None:
+                        break
+                    if not failure:
+                        try:
+                            await run_in_threadpool(process, frame)
+                        except Exception as e:
+                            failure.append(e)
+                if failure:
+                    raise failure[0]
+                await run_in_threadpool(writer.flush)
+
+            indexer = asyncio.create_task(index_frames())
+            completed = False
+            try:
+                async for frame in frames:
+                    if failure:
+                        break
+                    if frame.get("type") == "end":
+                        completed = True
+                        break
+                    if frame.get("type") in ("file", "delete") and frame.get("path"):
+                        session.touched = time.time()
+                        await queue.put(frame)
+            finally:
+                await queue.put(None)
+                try:
+                    await indexer
+                finally:
+                    # Once per request, so other workers reload after the upload rather than per batch
+                    await run_in_threadpool(registry.bump, collection.name)
+
+        if completed:
+            upload_sessions.pop(session.session_id, None)
         return {
-            "status": "uploaded_incremental",
-            "changed_files": len(files),
-            "deleted_files": len(deleted),
-            "chunks_added": total_added
+            "status": "uploaded_stream" if completed else "partial",
+            "sessionId": session.session_id,
+            "resumed": resumed,
+            "chunks_added": writer.added,
+            **totals,
         }
 
+    except StopAsyncIteration:
+        return {"error": "Empty upload stream."}
     except Exception as e:
-        print("Error in upload_folder:", e)
+        print("Error in upload_stream:", e)
         return {"error": str(e)}
 
+@router.get("/upload-stream/{session_id}")
+async def upload_stream_status(session_id: str):
+    """Paths an interrupted streaming upload already committed, so the client can skip them on resume."""
+    _expire_upload_sessions()
+    session = upload_sessions.get(session_id)
+    if session is None:
+        return {"error": "Unknown or expired upload session."}
+    return {
+        "sessionId": session.session_id,
+        "machineId": session.machine_id,
+        "projectName": session.project_name,
+        "incremental": session.incremental,
+        "in_progress": session.lock.locked(),
+        "committed": sorted(session.committed),
+    }
+
 # ---------- Semantic Search ----------
+# request -> (generation, response); entries die as soon as the collection is written to
+search_cache = LRUCache(SEARCH_CACHE_ENTRIES, 64 * 1024 * 1024)
+
+def _glob_condition(globs: list, negate: bool):
+    """
+    Push `*.ext` and `dir/**` globs down as metadata filters. Returns None when some glob
+    can't be expressed that way; those are still enforced by path_allowed() afterwards.
+    """
+    exts, dirs = [], []
+    for glob in globs:
+        glob = glob.replace("\\", "/").removeprefix("**/")
+        if glob.startswith("*.") and not any(c in glob[2:] for c in "*?[/"):
+            exts.append(glob[1:].lower())
+        elif glob.endswith("/**") and not any(c in glob[:-3] for c in "*?[/"):
+            dirs.append(glob[:-3])
+        else:
+            return None
+    op = "$nin" if negate else "$in"
+    conditions = ([{"ext": {op: exts}}] if exts else []) + ([{"top_dir": {op: dirs}}] if dirs else [])
+    if len(conditions) == 2:
+        return {"$and" if negate else "$or": conditions}
+    return conditions[0] if conditions else None
+
+def path_filter(include: list, exclude: list):
+    conditions = [c for c in (
+        _glob_condition(include, negate=False) if include else None,
+        _glob_condition(exclude, negate=True) if exclude else None,
+    ) if c]
+    if len(conditions) == 2:
+        return {"$and": conditions}
+    return conditions[0] if conditions else None
+
+def path_allowed(file_path: str, include: list, exclude: list) -> bool:
+    path = file_path.replace("\\", "/")
+    if include and not any(fnmatch.fnmatchcase(path, g.replace("\\", "/")) for g in include):
+        return False
+    if exclude and any(fnmatch.fnmatchcase(path, g.replace("\\", "/")) for g in exclude):
+        return False
+    return True
+
+def _cosine(a, b) -> float:
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    return float(np.dot(a, b) / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0))
+
+def search_collection(collection, lexical, queries: list, top_k: int, min_score: float = None,
+                      include: list = None, exclude: list = None) -> list:
+    """
+    Hybrid search for several queries at once. Returns, per query, a list of
+    (chunk_id, score, metadata, document) ordered best first.
+    Scores are cosine similarity for every hit, identifier fast-path hits included, and
+    min_score applies to all of them.
+    """
+    candidates = max(SEARCH_CANDIDATES, top_k * 4) * (2 if include or exclude else 1)
+    ranked = [None] * len(queries)
+    records = {}        # chunk_id -> (metadata, document)
+
+    # Identifier lookups (`iter_chunks`, `BasicToolNode`) are ranked by the inverted
+    # index alone: no vector query, only a score from the hits' stored vectors
+    semantic, exact = [], {}
+    for qi, query in enumerate(queries):
+        if not query.strip():
+            ranked[qi] = []
+            continue
+        if is_identifier_query(query):
+            hits = [h["id"] for h in lexical.search(query, candidates, exact=True)
+                    if path_allowed(h["file_path"], include, exclude)]
+            if hits:
+                exact[qi] = hits
+                continue
+        semantic.append(qi)
+
+    embedded = semantic + list(exact)
+    if not embedded:
+        return [[] for _ in queries]
+    # One embedding call for the batch; repeated queries come from the query cache
+    vectors = dict(zip(embedded, embed_queries([queries[qi] for qi in embedded])))
+
+    per_query = []
+    lexical_only = {cid for hits in exact.values() for cid in hits}
+    if semantic:
+        results = collection.query(
+            query_embeddings=[vectors[qi] for qi in semantic],
+            n_results=candidates,
+            where=path_filter(include, exclude),
+            include=["metadatas", "documents", "embeddings"],
+        )
+        for j, qi in enumerate(semantic):
+            scores, vector_ids = {}, []
+            for cid, metadata, document, embedding in zip(results["ids"][j], results["metadatas"][j],
+                                                          results["documents"][j], results["embeddings"][j]):
+                if not path_allowed(metadata["file_path"], include, exclude):
+                    continue
+                records[cid] = (metadata, document)
+                scores[cid] = _cosine(vectors[qi], embedding)
+                vector_ids.append(cid)
+            lexical_ids = [h["id"] for h in lexical.search(queries[qi], candidates)
+                           if path_allowed(h["file_path"], include, exclude)]
+            lexical_only.update(cid for cid in lexical_ids if cid not in scores)
+            per_query.append((qi, scores, vector_ids, lexical_ids))
+
+    # Lexical-only candidates get a real similarity score from their stored vectors (no API call)
+    stored = {}
+    if lexical_only:
+        got = collection.get(ids=list(lexical_only), include=["metadatas", "documents", "embeddings"])
+        for cid, metadata, document, embedding in zip(got["ids"], got["metadatas"],
+                                                      got["documents"], got["embeddings"]):
+            records[cid] = (metadata, document)
+            stored[cid] = embedding
+
+    for qi, hits in exact.items():
+        # Kept in BM25 order: an exact identifier match outranks a merely similar chunk
+        scored = [(cid, _cosine(vectors[qi], stored[cid])) for cid in hits if cid in stored]
+        if min_score is not None:
+            scored = [(cid, score) for cid, score in scored if score >= min_score]
+        ranked[qi] = scored[:top_k]
+
+    for qi, scores, vector_ids, lexical_ids in per_query:
+        for cid in lexical_ids:
+            if cid not in scores and cid in stored:
+                scores[cid] = _cosine(vectors[qi], stored[cid])
+        fused = [cid for cid in reciprocal_rank_fusion(vector_ids, lexical_ids) if cid in scores]
+        if min_score is not None:
+            fused = [cid for cid in fused if scores[cid] >= min_score]
+        ranked[qi] = [(cid, scores[cid]) for cid in fused[:top_k]]
+
+    return [[(cid, score, *records[cid]) for cid, score in hits if cid in records] for hits in ranked]
+
+def format_match(score: float, metadata: dict, document: str) -> dict:
+    line_start = metadata["line_start"]
+    return {
+        "file_path": metadata["file_path"],
+        "line_number": line_start,
+        "line_start": line_start,
+        "line_end": metadata.get("line_end", line_start + document.count("\n")),
+        "score": round(score, 4),
+        "snippet": document[:SNIPPET_CHARS],
+    }
+
+def retrieve_context(machine_id: str, project_name: str, query: str, token_budget: int,
+                     top_k: int = CHAT_CONTEXT_TOP_K, include: list = None, exclude: list = None) -> list:
+    """
+    Best-ranked chunks of a project for `query`, whole chunks only, until token_budget is spent.
+    Raises Chroma's not-found error when the project hasn't been uploaded.
+    """
+    with registry.pinned(machine_id, create=False):
+        collection = registry.get_collection(machine_id, project_name)
+        lexical = lexical_index(machine_id, project_name)
+        hits = search_collection(collection, lexical, [query], top_k, include=include, exclude=exclude)[0]
+
+    results, used = [], 0
+    for _, score, metadata, document in hits:
+        tokens = count_tokens(document)
+        if used + tokens > token_budget:
+            continue    # a smaller, lower-ranked chunk may still fit
+        used += tokens
+        match = format_match(score, metadata, document)
+        match["snippet"] = document
+        results.append(match)
+    return results
+
 @router.post("/semantic-search")
-async def semantic_search(payload: SemanticSearchRequest):
+def semantic_search(payload: SemanticSearchRequest):
     try:
         machine_id = payload.machineId
-        query = payload.query
         project_name = payload.projectName
-        user_path = f"./chroma_db/{machine_id}"
-
-        client = PersistentClient(path=user_path)
-
-        collection = client.get_collection(f"{machine_id}-{project_name}", embedding_function=embedding_function)
-
-        results = collection.query(query_texts=[query], n_results=3)
-
-        if results["documents"] and len(results["documents"][0]) > 0:
-            top_matches = []
-            for i in range(len(results["documents"][0])):
-                metadata = results["metadatas"][0][i]
-                top_matches.append({
-                    "file_path": metadata["file_path"],
-                    "line_number": metadata["line_start"]
-                })
-
-            return {"matches": top_matches}
-        else:
-            return {"error": "No match found"}
+        batch = payload.queries is not None
+        queries = payload.queries if batch else [payload.query or ""]
+        if not any(q.strip() for q in queries):
+            return {"error": "Provide a query or queries."}
+        top_k = max(1, min(payload.top_k or SEARCH_TOP_K, SEARCH_MAX_TOP_K))
+
+        with registry.pinned(machine_id, create=False):
+            collection = registry.get_collection(machine_id, project_name)
+            lexical = lexical_index(machine_id, project_name)
+
+            generation = registry.generation(collection.name)
+            cache_key = (collection.name, batch, tuple(normalize_query(q) for q in queries), top_k,
+                         payload.min_score, tuple(payload.include or ()), tuple(payload.exclude or ()))
+            cached = search_cache.get(cache_key)
+            if cached is not None and cached[0] == generation:
+                return cached[1]
+
+            results = search_collection(collection, lexical, queries, top_k, payload.min_score,
+                                        payload.include, payload.exclude)
+            matches = [[format_match(score, metadata, document) for _, score, metadata, document in hits]
+                       for hits in results]
+
+            if batch:
+                response = {"results": [{"query": q, "matches": m} for q, m in zip(queries, matches)]}
+            elif matches[0]:
+                response = {"matches": matches[0]}
+            else:
+                return {"error": "No match found"}
+
+            search_cache.set(cache_key, (generation, response), SEARCH_CACHE_TTL, len(json.dumps(response)))
+        return response
     except Exception as e:
         error_message = str(e)
         if "does not exist" in error_message and "Collection" in error_message:
+            # The cached handle may be stale (deleted elsewhere); resolve it again next time
+            registry.invalidate(payload.machineId, payload.projectName)
             return {"error": "This project hasn't been uploaded yet. Please upload the folder first."}
         else:
             print("Error in semantic_search:", e)
             return {"error": "An unexpected error occurred. Please try again."}
 
 @router.post("/delete-project")
-async def delete_project(payload: DeleteProjectRequest):
+def delete_project(payload: DeleteProjectRequest):
     try:
         machine_id   = payload.machineId
         project_name = payload.projectName
 
-        user_path = f"./chroma_db/{machine_id}"
-        coll_name = f"{machine_id}-{project_name}"
+        # Queued uploads (in any worker) would recreate the project right after it's deleted
+        for status in job_queue.statuses_for((machine_id, project_name)):
+            job_queue.request_cancel(status["jobId"])
 
-        client = PersistentClient(path=user_path)
+        if not registry.exists(machine_id):
+            return {"status": "not_found", "projectName": project_name}
 
-        # Chroma raises if the collection doesn't exist
-        try:
-            client.delete_collection(name=coll_name)
-            return {"status": "deleted", "projectName": project_name}
-        except Exception as e:
-            msg = str(e).lower()
-            # Treat "not found" as a graceful outcome so UX stays simple
-            if "not found" in msg or "no collection" in msg or "does not exist" in msg:
-                return {"status": "not_found", "projectName": project_name}
-            raise
+        with registry.write_lock(machine_id), registry.pinned(machine_id):
+            # Chroma raises if the collection doesn't exist
+            lexical_index(machine_id, project_name).reset()
+            try:
+                registry.delete_collection(machine_id, project_name)
+                return {"status": "deleted", "projectName": project_name}
+            except Exception as e:
+                msg = str(e).lower()
+                # Treat "not found" as a graceful outcome so UX stays simple
+                if "not found" in msg or "no collection" in msg or "does not exist" in msg:
+                    return {"status": "not_found", "projectName": project_name}
+                raise
 
     except Exception as e:
         print("Error in delete_project:", e)
@@ -0,0 +1,157 @@
+import os
+import time
+import sqlite3
+import threading
+
+WEB_CONCURRENCY          = int(os.getenv("WEB_CONCURRENCY", "1"))       # uvicorn worker processes
+SHARED_STORE_PATH        = os.getenv("SHARED_STORE_PATH", "./shared_state.sqlite3")
+SHARED_STORE_MAX_ROWS    = int(os.getenv("SHARED_STORE_MAX_ROWS", "50000"))
+REDIS_URL                = os.getenv("REDIS_URL")    # set to share state across hosts instead of one machine
+SHARED_STORE_PRUNE_EVERY = 256                        # writes between expiry sweeps
+
+# ---------- Local backend ----------
+class SqliteStore:
+    """
+    Small key/value store shared by every worker process on the host (WAL, so readers
+    never block the writer). Keys with a TTL are pruned by age and a row cap; keys
+    without one (counters) are kept.
+    """
+
+    def __init__(self, path: str = SHARED_STORE_PATH, max_rows: int = SHARED_STORE_MAX_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self._conn = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM kv WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def set(self, key: str, value: str, ttl: float = None) -> None:
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, value, expires_at))
+            self._writes += 1
+            if self._writes % SHARED_STORE_PRUNE_EVERY == 0:
+                self._prune(conn)
+            conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            conn.commit()
+
+    def incr(self, key: str) -> int:
+        """Atomically add one to a counter (missing counts as 0) and return the new value."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, '1', NULL)"
+                " ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                (key,),
+            )
+            value = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0]
+            conn.commit()
+            return int(value)
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        """Take (or renew) a lease: True if key is now held by owner until ttl seconds from now."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at"
+                " WHERE kv.value = excluded.value OR kv.expires_at < ?",
+                (key, owner, now + ttl, now),
+            )
+            holder = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0]
+            conn.commit()
+        return holder == owner
+
+    def release(self, key: str, owner: str) -> None:
+        """Give up a lease, if owner still holds it."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM kv WHERE key = ? AND value = ?", (key, owner))
+            conn.commit()
+
+    def scan(self, prefix: str) -> list:
+        """(key, value) pairs whose key starts with prefix."""
+        now = time.time()
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT key, value, expires_at FROM kv WHERE key >= ? AND key < ?",
+                (prefix, prefix + "\uffff"),
+            ).fetchall()
+        return [(k, v) for k, v, expires_at in rows if expires_at is None or expires_at >= now]
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        conn.execute("DELETE FROM kv WHERE expires_at < ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM kv WHERE key IN ("
+            " SELECT key FROM kv WHERE expires_at IS NOT NULL ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        )
+
+# ---------- Redis backend ----------
+class RedisStore:
+    """Same interface on Redis, for workers spread over several hosts."""
+
+    def __init__(self, url: str):
+        # Imported lazily so redis is only needed when REDIS_URL is set
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str):
+        return self.client.get(key)
+
+    def set(self, key: str, value: str, ttl: float = None) -> None:
+        self.client.set(key, value, px=int(ttl * 1000) if ttl is not None else None)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(key)
+
+    def incr(self, key: str) -> int:
+        return int(self.client.incr(key))
+
+    # Compare-and-set on the holder, so a lease that expired and was taken over isn't touched
+    _ACQUIRE = ("if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end"
+                " return redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) and 1 or 0")
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        return bool(self.client.eval(self._ACQUIRE, 1, key, owner, int(ttl * 1000)))
+
+    def release(self, key: str, owner: str) -> None:
+        self.client.eval(self._RELEASE, 1, key, owner)
+
+    def scan(self, prefix: str) -> list:
+        pattern = "".join("\\" + c if c in "*?[]\\" else c for c in prefix) + "*"
+        keys = list(self.client.scan_iter(match=pattern, count=500))
+        values = self.client.mget(keys) if keys else []
+        return [(k, v) for k, v in zip(keys, values) if v is not None]
+
+shared_store = RedisStore(REDIS_URL) if REDIS_URL else SqliteStore()
@@ -0,0 +1,19 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+# The backend modules import each other as top-level modules (uvicorn runs from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Every on-disk store goes to a scratch directory; set before any backend module is imported,
+# and inherited by worker processes the tests spawn
+_scratch = tempfile.mkdtemp(prefix="scraper-tests-")
+atexit.register(shutil.rmtree, _scratch, ignore_errors=True)
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("CHROMA_ROOT", os.path.join(_scratch, "chroma_db"))
+os.environ.setdefault("SHARED_STORE_PATH", os.path.join(_scratch, "shared_state.sqlite3"))
+os.environ.setdefault("TOOL_CACHE_PATH", os.path.join(_scratch, "tool_cache.sqlite3"))
+os.environ.setdefault("CHECKPOINT_SQLITE_PATH", os.path.join(_scratch, "checkpoints.sqlite3"))
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(_scratch, "embedding_cache.sqlite3"))
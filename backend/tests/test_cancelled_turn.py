@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+import pytest
+
+for module in ("fastapi", "langgraph", "langchain_openai", "chromadb", "tiktoken"):
+    pytest.importorskip(module)
+try:
+    import tiktoken
+    tiktoken.get_encoding("cl100k_base"), tiktoken.get_encoding("o200k_base")
+except Exception:
+    pytest.skip("tiktoken encodings aren't cached and can't be downloaded", allow_module_level=True)
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+import agent
+
+class FakeLLM:
+    """First call asks for a tool, later calls answer; records every prompt it is sent."""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def ainvoke(self, prompt):
+        self.prompts.append(prompt)
+        if len(self.prompts) == 1:
+            return AIMessage(content="", tool_calls=[{"id": "call_1", "name": "get_current_date", "args": {}}])
+        return AIMessage(content="done")
+
+class BlockingTool:
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def invoke(self, args):
+        self.started.set()
+        self.release.wait(10)
+        return "2026-01-01"
+
+def assert_tool_calls_answered(prompt):
+    pending = set()
+    for message in prompt:
+        if isinstance(message, ToolMessage):
+            pending.discard(message.tool_call_id)
+            continue
+        assert not pending, f"tool calls {pending} have no ToolMessage"
+        if isinstance(message, AIMessage):
+            pending = {call["id"] for call in message.tool_calls}
+    assert not pending
+
+def test_turn_cancelled_before_tools_leaves_thread_usable(monkeypatch):
+    llm, tool = FakeLLM(), BlockingTool()
+    monkeypatch.setattr(agent, "llm_with_tools", llm)
+    monkeypatch.setitem(agent.tool_node.tools_by_name, "get_current_date", tool)
+    graph = agent.builder.compile(checkpointer=MemorySaver())
+    config = {"configurable": {"thread_id": "cancelled-turn"}}
+
+    async def scenario():
+        first = asyncio.create_task(graph.ainvoke({"messages": [HumanMessage(content="what day is it?")]}, config))
+        while not tool.started.is_set():
+            await asyncio.sleep(0.01)
+        # What run_until_disconnected does when the client goes away mid-turn
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        tool.release.set()
+
+        state = await graph.aget_state(config)
+        assert state.values["messages"][-1].tool_calls, "the cancelled turn should end on the dangling call"
+
+        return await graph.ainvoke({"messages": [HumanMessage(content="and tomorrow?")]}, config)
+
+    result = asyncio.run(scenario())
+    assert result["messages"][-1].content == "done"
+    assert_tool_calls_answered(llm.prompts[-1])
@@ -0,0 +1,48 @@
+import multiprocessing
+
+import pytest
+
+for module in ("chromadb", "filelock", "tiktoken"):
+    pytest.importorskip(module)
+try:
+    import tiktoken
+    tiktoken.get_encoding("cl100k_base"), tiktoken.get_encoding("o200k_base")
+except Exception:
+    pytest.skip("tiktoken encodings aren't cached and can't be downloaded", allow_module_level=True)
+
+from chroma_registry import ChromaRegistry, CHROMA_ROOT, collection_name
+
+MACHINE, PROJECT = "machine", "project"
+
+def add_chunk(collection, chunk_id: str, embedding: list) -> None:
+    # Embeddings are passed in, so nothing calls the embedding API
+    collection.add(ids=[chunk_id], embeddings=[embedding], documents=[chunk_id],
+                   metadatas=[{"file_path": f"{chunk_id}.py", "line_start": 1}])
+
+def nearest(registry: ChromaRegistry, embedding: list) -> list:
+    with registry.pinned(MACHINE):
+        collection = registry.get_collection(MACHINE, PROJECT)
+        return collection.query(query_embeddings=[embedding], n_results=5)["ids"][0]
+
+def replace_chunk_in_other_worker() -> None:
+    registry = ChromaRegistry(CHROMA_ROOT)
+    with registry.write_lock(MACHINE), registry.pinned(MACHINE):
+        collection = registry.get_collection(MACHINE, PROJECT)
+        add_chunk(collection, "b", [0.0, 1.0, 0.0])
+        collection.delete(ids=["a"])
+        registry.bump(collection_name(MACHINE, PROJECT))
+
+def test_read_sees_write_from_another_process():
+    registry = ChromaRegistry(CHROMA_ROOT)
+    with registry.write_lock(MACHINE), registry.pinned(MACHINE):
+        add_chunk(registry.get_collection(MACHINE, PROJECT, create=True), "a", [1.0, 0.0, 0.0])
+        registry.bump(collection_name(MACHINE, PROJECT))
+    # Loads this worker's copy of the vector index
+    assert nearest(registry, [0.0, 1.0, 0.0]) == ["a"]
+
+    worker = multiprocessing.get_context("spawn").Process(target=replace_chunk_in_other_worker)
+    worker.start()
+    worker.join(60)
+    assert worker.exitcode == 0
+
+    assert nearest(registry, [0.0, 1.0, 0.0]) == ["b"]
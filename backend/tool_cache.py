@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import inspect
+import functools
+from collections import OrderedDict, defaultdict
+
+import httpx
+
+import http_client
+
+TOOL_CACHE_PATH        = os.getenv("TOOL_CACHE_PATH", "./tool_cache.sqlite3")
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "2048"))
+TOOL_CACHE_MAX_BYTES   = int(os.getenv("TOOL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+TOOL_CACHE_DISK_MAX_ROWS = int(os.getenv("TOOL_CACHE_DISK_MAX_ROWS", "50000"))
+TOOL_CACHE_DISABLED    = os.getenv("TOOL_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+TOOL_CACHE_PRUNE_EVERY = 256             # disk writes between expiry/row-cap sweeps
+
+# Seconds a tool result stays fresh
+TOOL_TTLS = {
+    "get_weather": 10 * 60,
+    "brave_search": 60 * 60,
+    "github_code_search": 6 * 60 * 60,
+    "fetch_github_repo_code_summary": 60 * 60,
+    "vision_analyze": 24 * 60 * 60,        # keyed by image hash, so the answer never goes stale
+}
+DEFAULT_TTL = 15 * 60
+
+# ---------- In-memory tier ----------
+class LRUCache:
+    """Thread-safe LRU with per-entry expiry and entry/byte caps."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()   # key -> (expires_at, value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl: float, size: int) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (time.time() + ttl, value, size)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, key) -> None:
+        _, _, size = self._entries.pop(key)
+        self.total_bytes -= size
+
+# ---------- On-disk tier ----------
+class DiskCache:
+    """SQLite-backed tier shared by all threads (and workers pointing at the same file)."""
+
+    def __init__(self, path: str, max_rows: int):
+        self.path = path
+        self.max_rows = max_rows
+        self._conn = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tool_results ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS http_etags ("
+                " url TEXT PRIMARY KEY, etag TEXT NOT NULL, headers TEXT NOT NULL,"
+                " body BLOB NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM tool_results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO tool_results (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            if self._due_for_prune():
+                conn.execute("DELETE FROM tool_results WHERE expires_at < ?", (time.time(),))
+                conn.execute(
+                    "DELETE FROM tool_results WHERE key IN ("
+                    " SELECT key FROM tool_results ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+            conn.commit()
+
+    def get_etag(self, url: str):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT etag, headers, body FROM http_etags WHERE url = ?", (url,)
+            ).fetchone()
+
+    def set_etag(self, url: str, etag: str, headers: dict, body: bytes) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO http_etags (url, etag, headers, body, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (url, etag, json.dumps(headers), body, time.time()),
+            )
+            if self._due_for_prune():
+                conn.execute(
+                    "DELETE FROM http_etags WHERE url IN ("
+                    " SELECT url FROM http_etags ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+            conn.commit()
+
+    def _due_for_prune(self) -> bool:
+        """The sweeps scan the whole table, so they run every TOOL_CACHE_PRUNE_EVERY writes, not on each one."""
+        self._writes += 1
+        return self._writes % TOOL_CACHE_PRUNE_EVERY == 0
+
+memory_tier = LRUCache(TOOL_CACHE_MAX_ENTRIES, TOOL_CACHE_MAX_BYTES)
+disk_tier = DiskCache(TOOL_CACHE_PATH, TOOL_CACHE_DISK_MAX_ROWS)
+
+# ---------- Metrics ----------
+_stats = defaultdict(lambda: {"memory_hits": 0, "disk_hits": 0, "misses": 0, "revalidated": 0})
+_stats_lock = threading.Lock()
+
+def _count(name: str, field: str) -> None:
+    with _stats_lock:
+        _stats[name][field] += 1
+
+def cache_stats() -> dict:
+    with _stats_lock:
+        stats = {name: dict(counts) for name, counts in _stats.items()}
+    return {
+        "tools": stats,
+        "memory_entries": len(memory_tier._entries),
+        "memory_bytes": memory_tier.total_bytes,
+    }
+
+# ---------- Tool result caching ----------
+def _normalize(value):
+    if isinstance(value, str):
+        value = " ".join(value.split())
+        if value.startswith(("http://", "https://")):
+            value = value.rstrip("/").removesuffix(".git")
+            scheme, _, rest = value.partition("://")
+            host, _, path = rest.partition("/")
+            return f"{scheme}://{host.lower()}/{path}" if path else f"{scheme}://{host.lower()}"
+        return value.lower()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+def cache_key(name: str, args: dict) -> str:
+    payload = json.dumps(_normalize(args), sort_keys=True, ensure_ascii=False)
+    return f"{name}:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def cached_call(name: str, key: str, compute, ttl: float = None, cacheable=None):
+    """Return compute() through the memory and disk tiers under `key`."""
+    if TOOL_CACHE_DISABLED:
+        return compute()
+    ttl = ttl if ttl is not None else TOOL_TTLS.get(name, DEFAULT_TTL)
+
+    result = memory_tier.get(key)
+    if result is not None:
+        _count(name, "memory_hits")
+        return result
+
+    row = disk_tier.get(key)
+    if row is not None:
+        value, expires_at = row
+        result = json.loads(value)
+        memory_tier.set(key, result, expires_at - time.time(), len(value))
+        _count(name, "disk_hits")
+        return result
+
+    _count(name, "misses")
+    result = compute()
+    if cacheable is None or cacheable(result):
+        value = json.dumps(result, ensure_ascii=False)
+        memory_tier.set(key, result, ttl, len(value))
+        disk_tier.set(key, value, time.time() + ttl)
+    return result
+
+def cached_tool(name: str, ttl: float = None, cacheable=None):
+    """
+    Cache a tool function's results keyed on its normalized arguments.
+    `cacheable(result)` can reject results that shouldn't be reused (errors, missing keys).
+    Apply underneath @tool so the tool schema still comes from the wrapped function.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if TOOL_CACHE_DISABLED:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = cache_key(name, dict(bound.arguments))
+            return cached_call(name, key, lambda: func(*args, **kwargs), ttl, cacheable)
+        return wrapper
+    return decorator
+
+# ---------- Conditional requests ----------
+def conditional_get(url: str, headers: dict = None, **kwargs) -> httpx.Response:
+    """
+    GET with ETag revalidation. A 304 is answered from the stored body, which on GitHub
+    also doesn't count against the rate limit.
+    """
+    headers = dict(headers or {})
+    stored = None if TOOL_CACHE_DISABLED else disk_tier.get_etag(str(httpx.URL(url, params=kwargs.get("params"))))
+    if stored is not None:
+        headers["If-None-Match"] = stored[0]
+
+    response = http_client.get(url, headers=headers, **kwargs)
+    cache_url = str(response.request.url)
+
+    if response.status_code == 304 and stored is not None:
+        _count("http", "revalidated")
+        return httpx.Response(200, headers=json.loads(stored[1]), content=stored[2], request=response.request)
+
+    etag = response.headers.get("ETag")
+    if response.status_code == 200 and etag and not TOOL_CACHE_DISABLED:
+        keep = {k: v for k, v in response.headers.items() if k.lower() in ("content-type", "etag")}
+        disk_tier.set_etag(cache_url, etag, keep, response.content)
+    return response
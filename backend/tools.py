@@ -1,12 +1,18 @@
 from langchain.tools import tool
-import requests
+from langchain_core.tools import InjectedToolArg
+import http_client
+from tool_cache import cached_tool, cached_call, cache_key, conditional_get
+from semantic_search import retrieve_context
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 import json
-from openai import OpenAI
+import hashlib
+import contextvars
+from openai_clients import get_openai_client, VISION_MODEL
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Annotated
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
@@ -15,18 +21,40 @@ BRAVE_API_KEY = os.getenv("BRAVE_API_KEY")
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") 
 
+# Overridable so benchmarks can point the tools at local stand-ins
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+GITHUB_RAW_URL = os.getenv("GITHUB_RAW_URL", "https://raw.githubusercontent.com").rstrip("/")
+BRAVE_API_URL  = os.getenv("BRAVE_API_URL", "https://api.search.brave.com").rstrip("/")
+
+CODE_SNIPPET_CHARS   = 1500
+REPO_FILE_CHARS      = 4000                     # per-file cap, LLM-token-friendly
+REPO_SNAPSHOT_BYTES  = int(os.getenv("REPO_SNAPSHOT_BYTES", "32000"))
+REPO_MAX_FILES       = int(os.getenv("REPO_MAX_FILES", "12"))
+REPO_MAX_FILE_BYTES  = 256 * 1024               # bigger files are generated/vendored more often than not
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "3000"))
+
+# Raw file downloads for the GitHub tools fan out here
+github_fetch_pool = ThreadPoolExecutor(max_workers=int(os.getenv("GITHUB_FETCH_WORKERS", "8")),
+                                       thread_name_prefix="github-fetch")
+
+def fan_out(fn, items) -> list:
+    """github_fetch_pool.map, carrying the caller's context (trace ID, deadline) to each fetch."""
+    contexts = [contextvars.copy_context() for _ in items]
+    return list(github_fetch_pool.map(lambda context, item: context.run(fn, item), contexts, items))
+
 class VisionInput(BaseModel):
     image_base64: Optional[str] = None
     prompt: str 
 
 @tool
+@cached_tool("get_weather", cacheable=lambda r: r.startswith("Weather in "))
 def get_weather(city: str) -> str:
     """ Get current weather for a city using OpenWeather API""" 
     api_key = OPENWEATHER_API_KEY
     if not api_key:
         return "Weather API key not set."
     url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric"
-    resp = requests.get(url)
+    resp = http_client.get(url)
     if resp.status_code != 200:
         return "Weather data not found."
     data = resp.json()
@@ -35,15 +63,16 @@ def get_weather(city: str) -> str:
     return f"Weather in {city}: {desc}, {temp}°C"
 
 @tool
+@cached_tool("brave_search", cacheable=lambda r: r.startswith("["))
 def brave_search(query: str) -> str:
     """Search the web for useful results using Brave Search API and return structured summaries."""
     api_key = BRAVE_API_KEY
     if not api_key:
         return "Brave API key not set."
-    url = "https://api.search.brave.com/res/v1/web/search"
+    url = f"{BRAVE_API_URL}/res/v1/web/search"
     headers = {"X-Subscription-Token": api_key}
     params = {"q": query, "count": 3}
-    resp = requests.get(url, headers=headers, params=params)
+    resp = http_client.get(url, headers=headers, params=params)
     if resp.status_code != 200:
         return "No search results."
     data = resp.json()
@@ -59,7 +88,6 @@ def brave_search(query: str) -> str:
         }
         for r in results
     ]
-    print("brave")
     return json.dumps(structured, ensure_ascii=False, indent=2)
 
 @tool
@@ -68,6 +96,36 @@ def get_current_date() -> str:
     return datetime.now().strftime("%Y-%m-%d") 
 
 @tool
+def search_project_code(
+    query: str,
+    path_glob: Optional[str] = None,
+    machine_id: Annotated[Optional[str], InjectedToolArg] = None,
+    project_name: Annotated[Optional[str], InjectedToolArg] = None,
+) -> dict:
+    """
+    Search the user's uploaded project (the workspace open in VS Code) for code relevant to
+    the query. Returns the best-matching chunks with file paths and line ranges.
+    Use a natural-language description or an exact identifier; path_glob (e.g. "src/**",
+    "*.py") narrows the search.
+    """
+    if not machine_id or not project_name:
+        return {"error": "No project is attached to this chat; ask the user to upload their project."}
+    try:
+        matches = retrieve_context(machine_id, project_name, query, RETRIEVAL_TOKEN_BUDGET,
+                                   include=[path_glob] if path_glob else None)
+    except Exception as e:
+        if "does not exist" in str(e):
+            return {"error": "This project hasn't been uploaded yet."}
+        raise
+    if not matches:
+        return {"matches": [], "note": "No matching code found."}
+    return {"matches": [
+        {"file_path": m["file_path"], "lines": f'{m["line_start"]}-{m["line_end"]}', "code": m["snippet"]}
+        for m in matches
+    ]}
+
+@tool
+@cached_tool("github_code_search", cacheable=lambda r: r.startswith("File: "))
 def github_code_search(query: str) -> str:
     """
     Search GitHub for code snippets matching a query and return structured usable codeblocks the user can use directly.
@@ -80,8 +138,8 @@ def github_code_search(query: str) -> str:
         "Accept": "application/vnd.github.v3+json"
     }
 
-    url = f"https://api.github.com/search/code?q={query}&per_page=3"
-    response = requests.get(url, headers=headers)
+    url = f"{GITHUB_API_URL}/search/code"
+    response = conditional_get(url, headers=headers, params={"q": query, "per_page": 3})
 
     if response.status_code != 200:
         return f"GitHub search failed: {response.status_code} - {response.text}"
@@ -90,100 +148,193 @@ def github_code_search(query: str) -> str:
     if not items:
         return "No code snippets found."
 
-    result_blocks = []
-    for item in items:
+    def build_block(item):
         file_name = item['name']
         repo_name = item['repository']['full_name']
         file_path = item['path']
         file_url = item.get("html_url")
-        raw_url = file_url.replace("github.com", "raw.githubusercontent.com").replace("/blob", "")
+        raw_url = f"{GITHUB_RAW_URL}/" + file_url.split("github.com/", 1)[1].replace("/blob/", "/", 1)
 
-        # Fetch actual raw code content
+        # Fetch actual raw code content (only the bytes we're going to show)
         try:
-            code_response = requests.get(raw_url)
-            if code_response.status_code != 200:
-                code_content = f"[Error fetching code: {code_response.status_code}]"
-            else:
-                code_content = code_response.text
+            code_content = fetch_raw_prefix(raw_url, CODE_SNIPPET_CHARS)
         except Exception as e:
             code_content = f"[Exception fetching code: {str(e)}]"
 
-        block = (
+        return (
             f"File: {file_name}\n"
             f"Repo: {repo_name}\n"
             f"Path: {file_path}\n"
             f"URL: {raw_url}\n\n"
             f"--- CODE START ---\n"
-            f"{code_content[:1500]}...\n"  # limit to 1500 characters for LLM usability
+            f"{code_content[:CODE_SNIPPET_CHARS]}...\n"  # limit to 1500 characters for LLM usability
             f"--- CODE END ---\n"
         )
 
-        result_blocks.append(block)
-    print("github")
+    result_blocks = fan_out(build_block, items)
 
     return "\n\n".join(result_blocks)
 
+# ---------- Repo snapshot heuristics ----------
+MANIFEST_FILES = {
+    "package.json", "requirements.txt", "pyproject.toml", "setup.py", "setup.cfg", "Pipfile",
+    "Cargo.toml", "go.mod", "pom.xml", "build.gradle", "build.gradle.kts", "Gemfile",
+    "composer.json", "Dockerfile", "docker-compose.yml", "Makefile", "CMakeLists.txt",
+}
+ENTRYPOINT_STEMS = {"main", "app", "index", "server", "cli", "__main__", "manage", "wsgi", "asgi", "extension"}
+SOURCE_EXTENSIONS = {
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".go", ".rs", ".java", ".kt", ".rb", ".php",
+    ".c", ".cc", ".cpp", ".h", ".hpp", ".cs", ".swift", ".scala", ".vue", ".svelte",
+}
+SKIP_DIRS = {"node_modules", "vendor", "dist", "build", "out", "target", ".git", ".github",
+             "__pycache__", "venv", ".venv", "third_party", "site-packages", "coverage"}
+SKIP_FILES = {"package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "Cargo.lock", "go.sum"}
+
+def _parse_repo_url(repo_url: str):
+    path = repo_url.split("github.com", 1)[1].strip("/:")
+    parts = path.split("/")
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        raise ValueError("Could not parse owner/repo from URL.")
+    return parts[0], parts[1].removesuffix(".git")
+
+def _score_repo_file(entry: dict, main_extensions: set):
+    """Higher is more useful for understanding the repo; None means skip."""
+    path = entry["path"]
+    parts = path.split("/")
+    name = parts[-1]
+    stem, dot, ext = name.rpartition(".")
+    ext = dot + ext if dot else ""
+    stem = stem if dot else name
+    depth = len(parts) - 1
+    size = entry.get("size", 0)
+
+    if any(p in SKIP_DIRS for p in parts[:-1]) or name in SKIP_FILES:
+        return None
+    if size == 0 or size > REPO_MAX_FILE_BYTES:
+        return None
+
+    if depth == 0 and name.lower().startswith("readme"):
+        return 100
+    if name in MANIFEST_FILES:
+        return 80 - 10 * depth
+    if ext not in SOURCE_EXTENSIONS:
+        return None
+
+    score = 20 if ext in main_extensions else 5
+    if stem.lower() in ENTRYPOINT_STEMS:
+        score += 40
+    if "test" in path.lower():
+        score -= 15
+    # Shallow, mid-sized files tend to carry the architecture
+    score -= 5 * depth
+    if size < 200:
+        score -= 10
+    return score
+
+def select_repo_files(tree: list) -> list:
+    blobs = [e for e in tree if e.get("type") == "blob"]
+    ext_counts = {}
+    for e in blobs:
+        name = e["path"].rsplit("/", 1)[-1]
+        if "." in name:
+            ext = "." + name.rsplit(".", 1)[1]
+            if ext in SOURCE_EXTENSIONS:
+                ext_counts[ext] = ext_counts.get(ext, 0) + 1
+    main_extensions = set(sorted(ext_counts, key=ext_counts.get, reverse=True)[:2])
+
+    scored = []
+    for e in blobs:
+        score = _score_repo_file(e, main_extensions)
+        if score is not None:
+            scored.append((score, e["path"], e))
+    scored.sort(key=lambda t: (-t[0], t[1]))
+
+    picked, budget = [], REPO_SNAPSHOT_BYTES
+    for _, _, e in scored:
+        if len(picked) >= REPO_MAX_FILES or budget <= 0:
+            break
+        picked.append(e)
+        budget -= min(e.get("size", 0), REPO_FILE_CHARS)
+    return picked
+
+def fetch_raw_prefix(raw_url: str, max_chars: int, headers: dict = None) -> str:
+    """Fetch at most the first ~max_chars of a raw file using a Range request."""
+    headers = dict(headers or {})
+    # 4 bytes covers the widest UTF-8 character
+    headers["Range"] = f"bytes=0-{max_chars * 4 - 1}"
+    resp = http_client.get(raw_url, headers=headers)
+    if resp.status_code not in (200, 206):
+        return f"[Error fetching code: {resp.status_code}]"
+    return resp.content.decode("utf-8", errors="ignore")[:max_chars]
+
 @tool
+@cached_tool("fetch_github_repo_code_summary", cacheable=lambda r: "error" not in r)
 def fetch_github_repo_code_summary(repo_url: str) -> dict:
     """
     Given a public GitHub repo URL, fetch key source code and metadata (README, main files, configs).
     Returns structured dict for LLM to analyze and explain what the repo does.
     """
-    import requests
-    import base64
-
     if "github.com" not in repo_url:
         return {"error": "Invalid GitHub URL."}
 
     try:
-        owner, repo = repo_url.strip("/").split("/")[-2:]
+        owner, repo = _parse_repo_url(repo_url)
     except Exception:
         return {"error": "Could not parse owner/repo from URL."}
 
-    headers = {
-        "Authorization": f"token {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github.v3+json"
+    headers = {"Accept": "application/vnd.github.v3+json"}
+    if GITHUB_TOKEN:
+        headers["Authorization"] = f"token {GITHUB_TOKEN}"
+
+    # One call for the whole file listing instead of probing fixed paths
+    tree_url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/git/trees/HEAD"
+    r = conditional_get(tree_url, headers=headers, params={"recursive": "1"})
+    if r.status_code != 200:
+        return {"error": f"Repository not found or inaccessible ({r.status_code})."}
+    tree = r.json().get("tree", [])
+
+    picked = select_repo_files(tree)
+    raw_headers = {"Authorization": headers["Authorization"]} if GITHUB_TOKEN else None
+
+    def fetch_file(entry):
+        raw_url = f"{GITHUB_RAW_URL}/{owner}/{repo}/HEAD/{entry['path']}"
+        try:
+            return {"filename": entry["path"], "content": fetch_raw_prefix(raw_url, REPO_FILE_CHARS, raw_headers)}
+        except Exception as e:
+            return {"filename": entry["path"], "error": f"Fetch error: {str(e)}"}
+
+    top_level = sorted({e["path"].split("/", 1)[0] + ("/" if "/" in e["path"] else "") for e in tree})
+    output = {
+        "repo": f"{owner}/{repo}",
+        "structure": top_level[:100],
+        "files": fan_out(fetch_file, picked),
     }
 
-    key_files = ["README.md", "main.py", "index.js", "app.py", "package.json", "requirements.txt"]
-    output = {"repo": f"{owner}/{repo}", "files": []}
-
-    for file in key_files:
-        api_url = f"https://api.github.com/repos/{owner}/{repo}/contents/{file}"
-        r = requests.get(api_url, headers=headers)
-        if r.status_code == 200:
-            try:
-                data = r.json()
-                content = base64.b64decode(data['content']).decode('utf-8')
-                output["files"].append({
-                    "filename": file,
-                    "content": content[:4000]  # Optional: LLM-token-friendly limit
-                })
-            except Exception as e:
-                output["files"].append({
-                    "filename": file,
-                    "error": f"Decoding error: {str(e)}"
-                })
-        else:
-            output["files"].append({
-                "filename": file,
-                "error": "File not found or inaccessible."
-            })
-    
-    print("summary")
     return output
 
 def vision_analyze(data: VisionInput) -> str:
-
-    client = OpenAI(api_key=OPENAI_API_KEY)
     image_base64 = data.image_base64
     prompt = data.prompt
 
     if not image_base64.startswith("data:image"):
         raise ValueError("Invalid image base64 data.")
 
+    # Same screenshot + same question (e.g. "explain" twice) is answered from the cache
+    image_hash = hashlib.sha256(image_base64.encode("utf-8")).hexdigest()
+    key = cache_key("vision_analyze", {"image": image_hash, "prompt": prompt, "model": VISION_MODEL})
+    return cached_call("vision_analyze", key, lambda: _vision_request(image_base64, prompt),
+                       cacheable=lambda r: bool(r))
+
+def _vision_request(image_base64: str, prompt: str) -> str:
+    client = get_openai_client()
+    deadline = http_client.current_deadline.get()
+    if deadline is not None:
+        # The OpenAI client retries on its own; as a tool call, stay inside the tool's budget
+        if deadline.remaining() <= 0:
+            raise http_client.DeadlineExceeded("Vision request cancelled or out of time.")
+        client = client.with_options(timeout=deadline.remaining(), max_retries=0)
     response = client.chat.completions.create(
-        model="gpt-4o",
+        model=VISION_MODEL,
         messages=[
             {
                 "role": "user",
@@ -195,5 +346,4 @@ def vision_analyze(data: VisionInput) -> str:
         ],
         max_tokens=1000
     )
-    print(response.choices[0].message.content)
     return response.choices[0].message.content
@@ -194,16 +194,43 @@ function activate(context) {
 			await vscode.window.withProgress({
 				location: vscode.ProgressLocation.Notification,
 				title: incremental ? "Syncing changes to agent..." : "Uploading project to agent...",
-				cancellable: false
-			}, async () => {
+				cancellable: true
+			}, async (progress, token) => {
 				try {
-					await axios.post('http://localhost:8000/semantic/upload-folder', {
+					const res = await axios.post('http://localhost:8000/semantic/upload-folder', {
 						machineId,
 						projectName,
 						incremental,         // 👈 tell backend this is an upsert
 						files: changedFiles, // only changed/new
 						deleted: deletedFiles
 					});
+					if (res.data.error) throw new Error(res.data.error);
+
+					// indexing runs as a background job: poll it until it finishes
+					let jobId = res.data.jobId;
+					token.onCancellationRequested(() => {
+						axios.post(`http://localhost:8000/semantic/jobs/${jobId}/cancel`).catch(() => {});
+					});
+					let job;
+					let reported = 0;
+					while (true) {
+						await new Promise(resolve => setTimeout(resolve, 1000));
+						job = (await axios.get(`http://localhost:8000/semantic/jobs/${jobId}`)).data;
+						if (job.error && !job.status) throw new Error(job.error);
+						if (job.status === 'superseded') { jobId = job.supersededBy; continue; }
+						const { stage, done, total } = job.progress;
+						if (total > 0) {
+							const pct = Math.floor(100 * done / total);
+							progress.report({ message: `${stage} ${done}/${total}`, increment: Math.max(0, pct - reported) });
+							reported = Math.max(reported, pct);
+						}
+						if (!['queued', 'running'].includes(job.status)) break;
+					}
+					if (job.status === 'cancelled') {
+						vscode.window.showWarningMessage("Upload cancelled.");
+						return;
+					}
+					if (job.status !== 'succeeded') throw new Error(job.error || job.status);
 
 					// persist new manifest on success
 					await context.globalState.update(manifestKey, currentManifest);
@@ -283,10 +310,12 @@ class ScraperChatViewProvider {
     this.webviewView = null;                
     this._currentSelectionText = null;      
     this._lastSelectionMeta = null;          
+    this._threadId = null;                   // backend conversation for this chat view
   }
 
 	resolveWebviewView(webviewView) {
     	this.webviewView = webviewView;     
+		this._threadId = null; // a freshly rendered view starts an empty chat, so a new conversation
 		    // 🔔 selection watcher
 		this.context.subscriptions.push(
 			vscode.window.onDidChangeTextEditorSelection(e => {
@@ -320,12 +349,22 @@ class ScraperChatViewProvider {
 			if (message.command === 'sendPrompt') {
 				let { requestId, text, image_base64, use_file, include_selection } = message; // 👈 new flag
 				let file_context = null;
+				let file_path = null;
 				let selection_text = null;
 
 				if (use_file) {
 					const activeEditor = vscode.window.activeTextEditor;
-					if (activeEditor) file_context = activeEditor.document.getText();
+					if (activeEditor) {
+						file_context = activeEditor.document.getText();
+						file_path = vscode.workspace.asRelativePath(activeEditor.document.uri, false);
+					}
 				}
+
+				// lets the backend search the uploaded project instead of relying on the whole file
+				const folders = vscode.workspace.workspaceFolders;
+				const projectName = folders && folders.length > 0
+					? path.basename(folders[0].uri.fsPath).replace(/[^a-zA-Z0-9._-]/g, '-').replace(/^-+|-+$/g, '')
+					: null;
 				if (include_selection) {
 					selection_text = this._currentSelectionText || null; // 👈 attach only if opted in
 				}
@@ -336,11 +375,13 @@ class ScraperChatViewProvider {
 
 					const response = await axios.post(
 						'http://localhost:8000/chat',
-						{ prompt: text, image_base64, file_context, selection_text}, // 👈 send it
+						{ prompt: text, image_base64, file_context, file_path, selection_text, machineId: vscode.env.machineId, projectName, thread_id: this._threadId }, // 👈 send it
 						{ signal: controller.signal }
 					);
 
 					pendingControllers.delete(requestId);
+					// keep talking in the same thread so the backend remembers earlier turns
+					if (response.data.thread_id) this._threadId = response.data.thread_id;
 					webviewView.webview.postMessage({ command: 'response', requestId, text: response.data.reply });
 				} catch (err) {
 					pendingControllers.delete(requestId);